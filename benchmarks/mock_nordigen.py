@@ -0,0 +1,302 @@
+"""
+Local stand-in for the Nordigen API, for offline development and load testing.
+
+Implements the token, institutions, requisitions, accounts, balances and
+transactions endpoints used by src/open_banking.py, serving large synthetic
+histories with optional latency, random 429s and a per-token rate limit.
+
+Run from the repository root and point the app at it:
+    python -m benchmarks.mock_nordigen --port 8080 --transactions 50000
+    NORDIGEN_URL=http://localhost:8080 streamlit run home.py
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from collections import Counter
+from dataclasses import dataclass
+from datetime import date, datetime, timezone
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from uuid import uuid4
+
+from benchmarks.synthetic import generate_transactions
+
+ACCESS_EXPIRES = 24 * 60 * 60
+REFRESH_EXPIRES = 30 * 24 * 60 * 60
+
+
+@dataclass
+class MockConfig:
+    """
+    Behaviour of the mock server
+
+    :param transactions: transactions per account
+    :param accounts: accounts per requisition
+    :param latency: mean added latency per request in seconds
+    :param jitter: added latency is uniform in latency +/- jitter
+    :param error_rate: fraction of data GETs answered with a random 429
+    :param rate_limit: requests per second allowed per token, 0 for no limit
+    :param burst: requests a token may make at once before rate limiting kicks in
+    """
+
+    transactions: int = 1000
+    accounts: int = 1
+    latency: float = 0.0
+    jitter: float = 0.0
+    error_rate: float = 0.0
+    rate_limit: float = 0.0
+    burst: int = 10
+
+
+class _TokenBucket:
+    "Per-token request budget refilled at rate requests per second"
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """
+        :returns: 0 if the request may proceed, seconds to wait otherwise
+        """
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+@lru_cache(maxsize=64)
+def _transactions_body(account_id: str, n: int) -> bytes:
+    # seeded by account so every request for an account returns the same history
+    transactions = generate_transactions(n, seed=zlib.crc32(account_id.encode()))
+    return json.dumps(transactions).encode()
+
+
+class MockNordigenServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server holding the mock's state: issued tokens,
+    requisitions and their accounts, rate limit buckets and request counters
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address: tuple, config: MockConfig = None):
+        super().__init__(address, _Handler)
+        self.config = config or MockConfig()
+        self.tokens = set()
+        self.requisitions = {}
+        self.buckets = {}
+        self.stats = Counter()
+        self.lock = threading.Lock()
+        self.rng = random.Random(0)
+
+    @property
+    def url(self) -> str:
+        "Base URL to set as open_banking.NORDIGEN_URL"
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+    def start(self) -> "MockNordigenServer":
+        "Serves in a background daemon thread"
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: MockNordigenServer
+
+    routes = [
+        ("POST", re.compile(r"/api/v2/token/new/$"), "token_new"),
+        ("POST", re.compile(r"/api/v2/token/refresh/$"), "token_refresh"),
+        ("GET", re.compile(r"/api/v2/institutions/?$"), "institutions"),
+        ("POST", re.compile(r"/api/v2/requisitions/$"), "requisition_create"),
+        ("GET", re.compile(r"/api/v2/requisitions/([\w-]+)/$"), "requisition_get"),
+        (
+            "DELETE",
+            re.compile(r"/api/v2/requisitions/([\w-]+)/$"),
+            "requisition_delete",
+        ),
+        ("GET", re.compile(r"/api/v2/accounts/([\w-]+)/balances/?$"), "balances"),
+        (
+            "GET",
+            re.compile(r"/api/v2/accounts/([\w-]+)/transactions/?$"),
+            "transactions",
+        ),
+    ]
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_DELETE(self):
+        self._dispatch("DELETE")
+
+    def _dispatch(self, method: str):
+        url = urlparse(self.path)
+        for route_method, pattern, name in self.routes:
+            match = pattern.match(url.path)
+            if route_method == method and match:
+                break
+        else:
+            return self._send(404, {"detail": "Not found."})
+        server, config = self.server, self.server.config
+        with server.lock:
+            server.stats[name] += 1
+            delay = max(0, config.latency + server.rng.uniform(-1, 1) * config.jitter)
+            # only data reads, which the client retries, get random 429s
+            random_429 = method == "GET" and server.rng.random() < config.error_rate
+        time.sleep(delay)
+        body = self._body()
+        if not name.startswith("token"):
+            access = self.headers.get("Authorization", "").replace("Bearer ", "")
+            if access not in server.tokens:
+                return self._send(401, {"detail": "Invalid token"})
+            retry_after = self._throttle(access)
+            if random_429 or retry_after:
+                with server.lock:
+                    server.stats["429"] += 1
+                return self._send(
+                    429,
+                    {"detail": "Rate limit exceeded"},
+                    {"Retry-After": f"{max(retry_after, 0.05):.2f}"},
+                )
+        getattr(self, name)(*match.groups(), query=parse_qs(url.query), body=body)
+
+    def _throttle(self, access: str) -> float:
+        config = self.server.config
+        if not config.rate_limit:
+            return 0
+        with self.server.lock:
+            bucket = self.server.buckets.setdefault(
+                access, _TokenBucket(config.rate_limit, config.burst)
+            )
+            return bucket.take()
+
+    def _body(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length)) if length else {}
+
+    def _send(self, status: int, payload, headers: dict = None):
+        data = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _issue(self) -> str:
+        access = uuid4().hex
+        with self.server.lock:
+            self.server.tokens.add(access)
+        return access
+
+    def token_new(self, query, body):
+        self._send(
+            200,
+            {
+                "access": self._issue(),
+                "access_expires": ACCESS_EXPIRES,
+                "refresh": uuid4().hex,
+                "refresh_expires": REFRESH_EXPIRES,
+            },
+        )
+
+    def token_refresh(self, query, body):
+        self._send(200, {"access": self._issue(), "access_expires": ACCESS_EXPIRES})
+
+    def institutions(self, query, body):
+        country = query.get("country", ["GB"])[0]
+        self._send(
+            200,
+            [
+                {
+                    "id": f"MOCKBANK{i}_{country}",
+                    "name": f"Mock Bank {i}",
+                    "bic": f"MOCK{i:04d}",
+                    "transaction_total_days": "730",
+                    "countries": [country],
+                    "logo": "",
+                }
+                for i in range(20)
+            ],
+        )
+
+    def requisition_create(self, query, body):
+        requisition = {
+            "id": str(uuid4()),
+            "created": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f%z"),
+            "institution_id": body.get("institution_id"),
+            "redirect": body.get("redirect"),
+            "status": "LN",
+            "accounts": [str(uuid4()) for _ in range(self.server.config.accounts)],
+        }
+        requisition["link"] = f"{self.server.url}/link/{requisition['id']}"
+        with self.server.lock:
+            self.server.requisitions[requisition["id"]] = requisition
+        self._send(201, requisition)
+
+    def requisition_get(self, requisition_id, query, body):
+        requisition = self.server.requisitions.get(requisition_id)
+        if requisition is None:
+            return self._send(404, {"detail": "Not found."})
+        self._send(200, requisition)
+
+    def requisition_delete(self, requisition_id, query, body):
+        with self.server.lock:
+            requisition = self.server.requisitions.pop(requisition_id, None)
+        if requisition is None:
+            return self._send(404, {"detail": "Not found."})
+        self._send(200, {"summary": "Requisition deleted"})
+
+    def balances(self, account_id, query, body):
+        self._send(
+            200,
+            {
+                "balances": [
+                    {
+                        "balanceAmount": {"amount": "1234.56", "currency": "EUR"},
+                        "balanceType": "expected",
+                        "referenceDate": date.today().isoformat(),
+                    }
+                ]
+            },
+        )
+
+    def transactions(self, account_id, query, body):
+        self._send(200, _transactions_body(account_id, self.server.config.transactions))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8080)
+    for field, default in vars(MockConfig()).items():
+        parser.add_argument(f"--{field.replace('_', '-')}", type=type(default))
+    args = vars(parser.parse_args())
+    config = MockConfig(
+        **{k: v for k, v in args.items() if k in vars(MockConfig()) and v is not None}
+    )
+    server = MockNordigenServer((args["host"], args["port"]), config)
+    print(f"Mock Nordigen API on {server.url} with {config}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+End-to-end sync throughput against the local mock Nordigen server.
+
+For every combination of N users x M accounts, registers the users, creates
+their requisitions through the API, then times syncing every account
+(balance + transactions over HTTP, normalisation and saving to sqlite).
+
+Run from the repository root:
+    python -m benchmarks.sync_throughput --users 1 10 --accounts 1 4 --latency 0.05
+Add --sharded to store each user in their own sqlite shard.
+"""
+
+import argparse
+import statistics
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from os import path
+
+from benchmarks.mock_nordigen import MockConfig, MockNordigenServer
+from src import open_banking, utils
+from src.autentication import register
+from src.storage import ROUTER
+from src.utils import create_tables
+
+
+def _sync(token: dict, username: str, account_id: str, db: path) -> tuple:
+    start = time.perf_counter()
+    saved, error = None, None
+    try:
+        saved = open_banking.sync_account(token, account_id, db, username)
+    except Exception as e:
+        error = type(e).__name__
+    return saved, error, time.perf_counter() - start
+
+
+def run(users: int, accounts: int, config: MockConfig, workers: int) -> dict:
+    """
+    Syncs users x accounts accounts against a fresh mock server and db
+
+    :param users: number of users
+    :param accounts: accounts per user
+    :param config: mock server behaviour, its accounts field is overridden
+    :param workers: number of accounts synced concurrently
+    :returns: dict of throughput and latency figures
+    """
+    # setup runs error free, random 429s only hit the timed syncs
+    setup = MockConfig(**{**vars(config), "accounts": accounts, "error_rate": 0})
+    server = MockNordigenServer(("localhost", 0), setup).start()
+    open_banking.NORDIGEN_URL = server.url
+    db = path.join(tempfile.mkdtemp(), "awesomebudget.db")
+    create_tables(db)
+    token = open_banking.request_token("benchmark-id", "benchmark-key")
+
+    account_ids = []
+    for i in range(users):
+        username = f"user{i}"
+        register(username, "password", db)
+        open_banking.create_requisition(token, "MOCKBANK0_GB", username, db)
+        for (requisition_id,) in open_banking.load_requisitions(username, db):
+            for account_id in open_banking.get_accounts(token, requisition_id)["ids"]:
+                open_banking.save_account(account_id, requisition_id, db, username)
+                account_ids.append((username, account_id))
+    server.stats.clear()
+    server.config = MockConfig(**{**vars(setup), "error_rate": config.error_rate})
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(workers) as pool:
+        results = list(pool.map(lambda x: _sync(token, *x, db), account_ids))
+    elapsed = time.perf_counter() - start
+    server.shutdown()
+    ROUTER.close_all()
+
+    saved = [n for n, _, _ in results if n is not None]
+    errors = Counter(e for _, e, _ in results if e is not None)
+    latencies = sorted(t for _, _, t in results)
+    return {
+        "sharded": str(utils.SHARDED),
+        "users": users,
+        "accounts": len(account_ids),
+        "failed": len(results) - len(saved),
+        "errors": ",".join(f"{k}:{v}" for k, v in sorted(errors.items())) or "-",
+        "transactions": sum(saved),
+        "seconds": elapsed,
+        "accounts_per_s": len(saved) / elapsed,
+        "transactions_per_s": sum(saved) / elapsed,
+        "p50_s": statistics.median(latencies),
+        "p95_s": latencies[int(0.95 * (len(latencies) - 1))],
+        "requests": sum(v for k, v in server.stats.items() if k != "429"),
+        "429s": server.stats["429"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--users", type=int, nargs="+", default=[1, 5])
+    parser.add_argument("--accounts", type=int, nargs="+", default=[1, 3])
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--transactions", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit", type=float, default=0.0)
+    parser.add_argument(
+        "--sharded", action="store_true", help="store each user in their own shard"
+    )
+    args = parser.parse_args()
+    utils.SHARDED = utils.SHARDED or args.sharded
+    config = MockConfig(
+        transactions=args.transactions,
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        rate_limit=args.rate_limit,
+    )
+
+    columns = [
+        "sharded",
+        "users",
+        "accounts",
+        "failed",
+        "errors",
+        "transactions",
+        "seconds",
+        "accounts_per_s",
+        "transactions_per_s",
+        "p50_s",
+        "p95_s",
+        "requests",
+        "429s",
+    ]
+    print(" ".join(f"{c:>18}" for c in columns))
+    for users in args.users:
+        for accounts in args.accounts:
+            result = run(users, accounts, config, args.workers)
+            cells = [
+                f"{x:>18.3f}" if isinstance(x, float) else f"{x:>18}"
+                for x in (result[c] for c in columns)
+            ]
+            print(" ".join(cells))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Synthetic Nordigen data for benchmarks
+"""
+
+import random
+from datetime import date, timedelta
+
+MERCHANTS = [
+    ("Tesco", "Groceries"),
+    ("Sainsbury's", "Groceries"),
+    ("Pret A Manger", "Lunch"),
+    ("Uber", "Trip"),
+    ("Transport for London", "Travel charge"),
+    ("Netflix", "Subscription"),
+    ("Spotify", "Subscription"),
+    ("Amazon", "Online purchase"),
+    ("Landlord Ltd", "Rent"),
+    ("British Gas", "Energy bill"),
+    ("Boots", "Pharmacy"),
+    ("Costa Coffee", "Coffee"),
+]
+
+
+def generate_transactions(
+    n: int,
+    seed: int = 0,
+    currency: str = "EUR",
+    pending_share: float = 0.02,
+    history_days: int = 3 * 365,
+) -> dict:
+    """
+    Generates a transactions response as per the Nordigen Schema
+
+    :param n: number of transactions
+    :param seed: random seed, the same seed always gives the same transactions
+    :param currency: ISO 4217 currency code for all transactions
+    :param pending_share: fraction of transactions that are pending
+    :param history_days: transactions are spread over this many days up to today
+    :returns: dict with booked and pending transactions, newest first
+    """
+    rng = random.Random(seed)
+    today = date.today()
+    booked, pending = [], []
+    days = sorted(rng.randrange(history_days) for _ in range(n))
+    for i, days_ago in enumerate(days):
+        creditor, description = rng.choice(MERCHANTS)
+        day = (today - timedelta(days=days_ago)).isoformat()
+        transaction = {
+            "transactionId": f"{seed}-{i:08d}",
+            "bookingDate": day,
+            "valueDate": day,
+            "transactionAmount": {
+                "amount": f"{-rng.lognormvariate(3, 1):.2f}",
+                "currency": currency,
+            },
+            "creditorName": creditor,
+            "remittanceInformationUnstructured": f"{description} {creditor}".upper(),
+            "bankTransactionCode": "PMNT",
+        }
+        if rng.random() < pending_share:
+            del transaction["transactionId"], transaction["bookingDate"]
+            pending.append(transaction)
+        else:
+            booked.append(transaction)
+    return {"transactions": {"booked": booked, "pending": pending}}
@@ -0,0 +1,42 @@
+"""
+Per-row memory footprint of normalised vs compact transactions.
+
+Run from the repository root:
+    python -m benchmarks.transactions_memory [rows ...]
+"""
+
+import sys
+
+from benchmarks.synthetic import generate_transactions
+from src.open_banking import _normalise_transactions, compact_transactions
+
+
+def footprint(rows: int) -> dict:
+    """
+    Measures deep memory usage of both representations
+
+    :param rows: number of synthetic transactions
+    :returns: dict with bytes per row for each representation
+    """
+    normalised = _normalise_transactions(generate_transactions(rows))
+    compact = compact_transactions(normalised)
+    return {
+        "rows": rows,
+        "normalised": normalised.memory_usage(deep=True).sum() / rows,
+        "compact": compact.memory_usage(deep=True).sum() / rows,
+    }
+
+
+def main(sizes: list) -> None:
+    print(f"{'rows':>10} {'normalised B/row':>17} {'compact B/row':>14} {'ratio':>6}")
+    for rows in sizes:
+        result = footprint(rows)
+        print(
+            f"{result['rows']:>10} {result['normalised']:>17.1f} "
+            f"{result['compact']:>14.1f} "
+            f"{result['normalised'] / result['compact']:>6.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main([int(x) for x in sys.argv[1:]] or [1_000, 10_000, 100_000])
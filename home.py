@@ -1,39 +1,46 @@
 import streamlit as st
-from os import environ, path
-from src.utils import create_tables
-from src.st_helpers import auth_wrapper, init_state, cache_wrapper
-from src.open_banking import (
-    generate_fernet,
-    load_token,
-    request_token,
-    save_token,
-    load_requisitions,
-    create_requisition,
-    save_requisition,
+from os import environ
+from src.startup import (
+    PROCESS_PROFILE,
+    StartupProfiler,
+    get_token,
+    init_once,
 )
 
-from src.autentication import (
-    AlreadyRegistredError,
-    AuthenticationError,
-    login,
-    register,
-)
+# Per-rerun profile, the cold start cost is recorded in PROCESS_PROFILE
+profile = StartupProfiler()
+
+with profile.step("import src.st_helpers"):
+    from src.st_helpers import (
+        auth_wrapper,
+        diagnostics_page,
+        init_state,
+        transactions_page,
+    )
 
 SECRETS = (environ.get("NG_ID"), environ.get("NG_KEY"))
 
 st.title("Awesome Budget \U0001F680 \U0001F4B0")
 
-create_tables()
-init_state(SECRETS)
-auth_wrapper()
+with profile.step("init_once"):
+    state = init_once(SECRETS)
+with profile.step("init_state"):
+    init_state(state["fernet"])
+with profile.step("auth_wrapper"):
+    auth_wrapper()
+if st.session_state.auth:
+    # only logged in pages call the API, so anonymous visits never import it
+    with profile.step("get_token"):
+        st.session_state.token = get_token(SECRETS)
+    transactions_page(st.session_state.auth[1])
 
-try:
-    st.session_state.token = load_token(
-        generate_fernet(SECRETS[0].encode("UTF-8"), SECRETS[1],)
-    )
-except:
-    st.session_state.token = request_token(*SECRETS)
-    save_token(
-        st.session_state.token, generate_fernet(SECRETS[0].encode("UTF-8"), SECRETS[1])
-    )
+if environ.get("AB_PROFILE_STARTUP"):
+    with st.expander("Startup profile"):
+        st.write("Cold start")
+        st.json(PROCESS_PROFILE.report(budget_ms=float("inf")))
+        st.write("This rerun")
+        st.json(profile.report())
 
+# metrics and cache stats are process wide, so only logged in users see them
+if st.session_state.auth and st.sidebar.checkbox("Diagnostics"):
+    diagnostics_page()
@@ -1,3 +1,30 @@
 """
 Functions to analyse and visualise spending
-"""
\ No newline at end of file
+"""
+
+import pandas as pd
+
+from src.open_banking import from_day_numbers, is_compact, minor_unit_scale
+
+
+def monthly_totals(transactions: pd.DataFrame) -> pd.Series:
+    """
+    Sums transaction amounts by booking month and currency
+
+    :param transactions: DataFrame as returned by get_transasctions, either
+    representation. Compact amounts are summed exactly in minor units
+    :returns: series of totals in major units indexed by (month, currency)
+    """
+    dates = transactions["bookingDate"]
+    if is_compact(transactions):
+        dates = from_day_numbers(dates)
+    keys = [
+        pd.to_datetime(dates).dt.to_period("M").rename("month"),
+        transactions["transactionAmount_currency"].rename("currency"),
+    ]
+    totals = transactions.groupby(keys, observed=True)["transactionAmount_amount"].sum()
+    if is_compact(transactions):
+        currency = totals.index.get_level_values("currency")
+        totals = totals / minor_unit_scale(currency.to_series(index=totals.index))
+        totals = totals.rename("transactionAmount_amount")
+    return totals
@@ -8,6 +8,8 @@ from uuid import uuid4
 
 from passlib.hash import argon2
 
+from src.instrumentation import connect, timer
+
 
 class AuthenticationError(Exception):
     "Exception for app autentication issues"
@@ -30,13 +32,15 @@ def login(
     """
     logs user in if the password matches SQLite record in the db
     """
-    with sqlite3.connect(db) as conn:
+    with connect(db) as conn:
         c = conn.cursor()
         query = c.execute("SELECT * FROM users WHERE username = ?", (username,))
         query = c.fetchone()
         if not query:
             raise AuthenticationError("Wrong username or password")
-        if argon2.verify(password, query[3]):
+        with timer("argon2.verify"):
+            verified = argon2.verify(password, query[3])
+        if verified:
             return query[0], query[2]
         raise AuthenticationError("Wrong username or password")
 
@@ -54,19 +58,21 @@ def register(
     :raises AlreadyRegistredError: if a given username is already present in the DB
     :raises sqlite3.IntegrityError: if there's erorrs with Sqlite data integrity
     """
-    with sqlite3.connect(db) as conn:
+    with connect(db) as conn:
         c = conn.cursor()
         query = c.execute("SELECT * FROM users WHERE username = ?", (username,))
         query = c.fetchall()
         if query:
             return AlreadyRegistredError(f"{username} is already registred")
+        with timer("argon2.hash"):
+            hashed = argon2.hash(password)
         try:
             c.execute(
                 """
                     INSERT INTO users
                      (user_id, username, password, salt) VALUES(?,?,?,?)
                 """,
-                (uuid4().bytes_le, username, argon2.hash(password), urandom(16),),
+                (uuid4().bytes_le, username, hashed, urandom(16),),
             )
             return None
         except sqlite3.IntegrityError as e:
@@ -78,7 +84,7 @@ def deregister(
 ) -> None:
     """not implemented"""
 
-    with sqlite3.connect(db) as conn:
+    with connect(db) as conn:
         c = conn.cursor()
         query = c.execute(
             """
@@ -0,0 +1,238 @@
+"""
+Process-wide cache of per-user data, shared by every Streamlit session.
+
+Entries are keyed by explicit CacheKeys scoped to a user and account, so they
+can be dropped when a sync or recategorisation lands.
+This module doesn't import streamlit, so data modules can call its
+invalidation hooks without importing the UI.
+"""
+
+import sys
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Iterable, NamedTuple, Optional
+
+
+class CacheKey(NamedTuple):
+    """
+    Explicit cache key, scoped to a user and optionally to one of their accounts
+
+    :param user: username owning the cached data
+    :param account: Nordigen account ID, None for user-wide data (e.g. aggregates)
+    :param name: what is cached, e.g. "transactions" or "balance"
+    :param params: any extra hashable parameters the value depends on
+    """
+
+    user: str
+    account: Optional[str]
+    name: str
+    params: tuple = ()
+
+
+@dataclass
+class CacheStats:
+    "Counters for UserCache"
+
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    expirations: int = 0
+    invalidations: int = 0
+
+
+def _sizeof(value: Any, seen: set = None) -> int:
+    """
+    Estimates the memory footprint of a cached value in bytes
+
+    :param value: value to measure
+    :param seen: ids of objects already counted, so shared objects count once
+    :returns: deep size for pandas objects, recursing into dicts, lists, tuples
+    and sets, shallow sys.getsizeof otherwise
+    """
+    seen = set() if seen is None else seen
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    if hasattr(value, "memory_usage"):
+        usage = value.memory_usage(deep=True)
+        return int(usage.sum()) if hasattr(usage, "sum") else int(usage)
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(_sizeof(k, seen) + _sizeof(v, seen) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(_sizeof(x, seen) for x in value)
+    return size
+
+
+class UserCache:
+    """
+    Process-wide LRU cache with per-entry TTL and a memory budget.
+
+    Unlike st.cache it never hashes arguments: callers build a CacheKey,
+    so tokens and DataFrames are never hashed and entries can be invalidated
+    per user/account when a sync or recategorisation lands.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 2**20, default_ttl: float = 600):
+        """
+        :param max_bytes: memory budget, least recently used entries are evicted past it
+        :param default_ttl: default time to live for entries in seconds
+        """
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.stats = CacheStats()
+        self._entries = OrderedDict()  # CacheKey -> (value, expires_at, size)
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def size(self) -> int:
+        "Estimated bytes currently held"
+        return self._size
+
+    def get(self, key: CacheKey, default: Any = None) -> Any:
+        """
+        Returns the cached value for key, marking it as recently used
+
+        :param key: CacheKey to look up
+        :param default: returned on a miss or an expired entry
+        :returns: cached value or default
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats.misses += 1
+                return default
+            if entry[1] < time.monotonic():
+                self._drop(key)
+                self.stats.expirations += 1
+                self.stats.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.stats.hits += 1
+            return entry[0]
+
+    def set(
+        self, key: CacheKey, value: Any, ttl: float = None, size: int = None
+    ) -> bool:
+        """
+        Stores value under key, evicting least recently used entries as needed
+
+        :param key: CacheKey to store value under
+        :param value: value to cache
+        :param ttl: time to live in seconds, defaults to self.default_ttl
+        :param size: size in bytes if known, estimated with _sizeof otherwise
+        :returns: False if value alone exceeds the memory budget and was not cached,
+        any previous value for key is dropped either way
+        """
+        size = _sizeof(value) if size is None else size
+        ttl = self.default_ttl if ttl is None else ttl
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            if size > self.max_bytes:
+                return False
+            self._entries[key] = (value, time.monotonic() + ttl, size)
+            self._size += size
+            while self._size > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.stats.evictions += 1
+        return True
+
+    def get_or_set(
+        self, key: CacheKey, f: Callable, *args, ttl: float = None, **kwargs
+    ) -> Any:
+        """
+        Returns the cached value for key, computing it with f(*args, **kwargs) on a miss
+
+        :param key: CacheKey to look up
+        :param f: callable producing the value
+        :param ttl: time to live in seconds, defaults to self.default_ttl
+        :returns: cached or freshly computed value
+        """
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            value = f(*args, **kwargs)
+            self.set(key, value, ttl=ttl)
+        return value
+
+    def invalidate(
+        self, user: str, account: str = None, names: Iterable[str] = None
+    ) -> int:
+        """
+        Drops entries for a user
+
+        :param user: username to drop entries for
+        :param account: if given, only drops this account's and user-wide entries
+        :param names: if given only drops entries with these names
+        :returns: number of entries dropped
+        """
+        names = None if names is None else set(names)
+        with self._lock:
+            stale = [
+                key
+                for key in self._entries
+                if key.user == user
+                and (account is None or key.account in (account, None))
+                and (names is None or key.name in names)
+            ]
+            for key in stale:
+                self._drop(key)
+            self.stats.invalidations += len(stale)
+        return len(stale)
+
+    def clear(self) -> None:
+        "Drops all entries, keeping the counters"
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def _drop(self, key: CacheKey) -> None:
+        self._size -= self._entries.pop(key)[2]
+
+
+# Module level so it survives Streamlit reruns and is shared between sessions
+CACHE = UserCache()
+
+# Cached names that depend on transaction categories
+CATEGORISED = ("transactions", "categories", "analytics", "budget")
+
+
+def cached_call(key: CacheKey, f: Callable, *args, ttl: float = None, **kwargs):
+    """
+    Calls f(*args, **kwargs) through the shared cache under an explicit key
+
+    :param key: CacheKey scoping the result to a user and account
+    :param f: callable producing the value
+    :param ttl: time to live in seconds, defaults to CACHE.default_ttl
+    :returns: cached or freshly computed value
+    """
+    return CACHE.get_or_set(key, f, *args, ttl=ttl, **kwargs)
+
+
+def on_sync(user: str, account: str = None) -> int:
+    """
+    Invalidation hook to call once a sync has landed
+
+    :param user: username that was synced
+    :param account: synced account ID, defaults to all of the user's accounts
+    :returns: number of entries dropped
+    """
+    return CACHE.invalidate(user, account)
+
+
+def on_recategorise(user: str, account: str = None) -> int:
+    """
+    Invalidation hook to call once transactions have been recategorised
+
+    :param user: username whose transactions were recategorised
+    :param account: recategorised account ID, defaults to all of the user's accounts
+    :returns: number of entries dropped
+    """
+    return CACHE.invalidate(user, account, CATEGORISED)
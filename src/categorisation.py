@@ -4,25 +4,15 @@ ML model to categorise tranasctions and related functions
 
 from os import path
 
+import numpy as np
 import pandas as pd
 from joblib import dump, load
 from sklearn.base import ClassifierMixin
 from sklearn.feature_extraction.text import HashingVectorizer
 from sklearn.linear_model import PassiveAggressiveClassifier
 
-categories = {
-    "Entertainment": 1,
-    "Food and Drink": 2,
-    "Groceries": 3,
-    "Shopping": 4,
-    "Health": 5,
-    "Savings and investments": 6,
-    "Transport and Travel": 7,
-    "Housing, Taxes and Utilities": 8,
-    "Transfers": 9,
-    "Subscriptions and services": 10,
-    "Other": 11,
-}
+from src.instrumentation import timer
+from src.utils import categories
 
 
 def init_model(
@@ -63,10 +53,35 @@ def fit_batch(
     X = vectorizer.fit_transform(X)
 
     classifier = PassiveAggressiveClassifier()
-    classifier = classifier.partial_fit(X, y, classes=classes.values())
+    classifier = classifier.partial_fit(X, y, classes=list(classes.values()))
     return classifier
 
 
+def predict(
+    model: ClassifierMixin, vectorizer: HashingVectorizer, X: pd.Series
+) -> pd.Series:
+    """
+    Predicts categories for a series of transaction descriptions
+
+    :param model: fitted classifier
+    :param vectorizer: vectorizer the model was fitted with
+    :param X: series of strings to categorise, categoricals are predicted once per
+    distinct value, missing values are categorised as "Other"
+    :returns: series of category ids with the same index as X
+    """
+    with timer("model.predict") as t:
+        t.size = len(X)
+        if X.dtype == "category":
+            y = model.predict(vectorizer.transform(X.cat.categories.astype(str)))
+            # code -1 (missing value) picks the appended "Other"
+            y = np.append(y, categories["Other"])[X.cat.codes.to_numpy()]
+        else:
+            missing = X.isna().to_numpy()
+            y = model.predict(vectorizer.transform(X.fillna("").astype(str)))
+            y = np.where(missing, categories["Other"], y)
+    return pd.Series(y, index=X.index)
+
+
 def serialise_model(
     model: ClassifierMixin, vectorizer: HashingVectorizer, dir: path
 ) -> bool:
@@ -0,0 +1,32 @@
+"""
+Derives the Fernet cypher used to encrypt API tokens at rest.
+
+Kept apart from src.open_banking so startup can build the cypher without
+importing pandas and requests.
+"""
+
+import base64
+
+from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+
+from src.instrumentation import instrumented
+
+
+@instrumented("crypto.generate_fernet")
+def generate_fernet(salt: bytes, password: str) -> Fernet:
+    """
+    Generates a Fernet cypher from a given salt and password
+
+    :param salt: a fixed salt
+    :param password: password to use
+    :returns: The Fernet cypherwith base64 url
+
+    :note: This function is deterministic so should always
+    return the same cypher from the same salt and password
+    """
+    kdf = PBKDF2HMAC(algorithm=hashes.SHA256(), length=32, salt=salt, iterations=390000)
+    return Fernet(
+        base64.urlsafe_b64encode(kdf.derive(bytes(password, encoding="utf8")))
+    )
@@ -0,0 +1,270 @@
+"""
+Lightweight hot-path instrumentation: call counts, latency and payload size histograms.
+
+Disabled by default, set AB_INSTRUMENT=1 or call enable() to start recording.
+When disabled timer() returns a shared no-op context manager, instrumented
+functions make a single flag check and connect() returns a plain sqlite3 connection.
+"""
+
+import json
+import re
+import sqlite3
+import threading
+import time
+from functools import wraps
+from os import environ
+
+LATENCY_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+SIZE_BUCKETS = (2**8, 2**10, 2**12, 2**14, 2**16, 2**18, 2**20, 2**22)
+
+ENABLED = bool(environ.get("AB_INSTRUMENT"))
+
+_LOCK = threading.Lock()
+_SQL_TABLE = re.compile(
+    r"\b(?:FROM|INTO|UPDATE|TABLE(?: IF NOT EXISTS)?|INDEX(?: IF NOT EXISTS)?)\s+(\w+)",
+    re.IGNORECASE,
+)
+
+
+class Metric:
+    """
+    Count, latency histogram and optional payload size histogram for one call site
+    """
+
+    __slots__ = ("count", "total_ms", "latency", "sized", "total_size", "sizes")
+
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self.latency = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.sized = 0
+        self.total_size = 0
+        self.sizes = [0] * (len(SIZE_BUCKETS) + 1)
+
+    def observe(self, ms: float, size: int = None) -> None:
+        """
+        Records one call
+
+        :param ms: call latency in milliseconds
+        :param size: payload size (bytes for HTTP, rows for predictions), if known
+        """
+        self.count += 1
+        self.total_ms += ms
+        self.latency[_bucket(ms, LATENCY_BUCKETS_MS)] += 1
+        if size is not None:
+            self.sized += 1
+            self.total_size += size
+            self.sizes[_bucket(size, SIZE_BUCKETS)] += 1
+
+    def to_dict(self) -> dict:
+        "Returns the metric as a JSON serialisable dict"
+        return {
+            "count": self.count,
+            "total_ms": round(self.total_ms, 3),
+            "mean_ms": round(self.total_ms / self.count, 3) if self.count else None,
+            "latency_ms": _histogram(self.latency, LATENCY_BUCKETS_MS),
+            "total_size": self.total_size,
+            "sizes": _histogram(self.sizes, SIZE_BUCKETS) if self.sized else {},
+        }
+
+
+REGISTRY = {}
+
+
+def _bucket(value: float, buckets: tuple) -> int:
+    for i, bound in enumerate(buckets):
+        if value <= bound:
+            return i
+    return len(buckets)
+
+
+def _histogram(counts: list, buckets: tuple) -> dict:
+    labels = [str(b) for b in buckets] + ["+Inf"]
+    return dict(zip(labels, counts))
+
+
+def enable() -> None:
+    "Starts recording"
+    global ENABLED
+    ENABLED = True
+
+
+def disable() -> None:
+    "Stops recording, keeping what has been recorded so far"
+    global ENABLED
+    ENABLED = False
+
+
+def reset() -> None:
+    "Drops all recorded metrics"
+    with _LOCK:
+        REGISTRY.clear()
+
+
+def observe(name: str, ms: float, size: int = None) -> None:
+    """
+    Records one call of the named call site
+
+    :param name: metric name, e.g. "nordigen.transactions"
+    :param ms: call latency in milliseconds
+    :param size: payload size, if known
+    """
+    with _LOCK:
+        metric = REGISTRY.get(name)
+        if metric is None:
+            metric = REGISTRY[name] = Metric()
+        metric.observe(ms, size)
+
+
+class _Timer:
+    __slots__ = ("name", "size", "_start")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.size = None
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.name, (time.perf_counter() - self._start) * 1000, self.size)
+
+
+class _NoopTimer:
+    size = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NOOP = _NoopTimer()
+
+
+def timer(name: str):
+    """
+    Context manager timing the enclosed block.
+    Set .size on the returned object to record a payload size
+
+    :param name: metric name
+    :returns: a timer, or a shared no-op if instrumentation is disabled
+    """
+    return _Timer(name) if ENABLED else _NOOP
+
+
+def instrumented(name: str = None):
+    """
+    Decorator timing every call of the decorated function
+
+    :param name: metric name, defaults to module.qualname of the function
+    """
+
+    def decorator(f):
+        metric = name or f"{f.__module__}.{f.__qualname__}"
+
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return f(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return f(*args, **kwargs)
+            finally:
+                observe(metric, (time.perf_counter() - start) * 1000)
+
+        return wrapper
+
+    return decorator
+
+
+def _sql_metric(sql: str) -> str:
+    verb = sql.split(None, 1)[0].upper() if sql.strip() else "EMPTY"
+    table = _SQL_TABLE.search(sql)
+    return f"sqlite.{verb}.{table.group(1)}" if table else f"sqlite.{verb}"
+
+
+class _TimedCursor(sqlite3.Cursor):
+    def execute(self, sql, *args):
+        with timer(_sql_metric(sql)):
+            return super().execute(sql, *args)
+
+    def executemany(self, sql, *args):
+        with timer(_sql_metric(sql)):
+            return super().executemany(sql, *args)
+
+
+class _TimedConnection(sqlite3.Connection):
+    def cursor(self, factory=_TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, *args):
+        return self.cursor().execute(sql, *args)
+
+    def executemany(self, sql, *args):
+        return self.cursor().executemany(sql, *args)
+
+
+def connect(db, **kwargs) -> sqlite3.Connection:
+    """
+    Drop-in replacement for sqlite3.connect timing every statement when enabled
+
+    :param db: path to sqlite db
+    :param kwargs: passed through to sqlite3.connect
+    :returns: sqlite3 Connection
+    """
+    if ENABLED:
+        kwargs.setdefault("factory", _TimedConnection)
+    return sqlite3.connect(db, **kwargs)
+
+
+def to_dict() -> dict:
+    "Returns all metrics as a JSON serialisable dict"
+    with _LOCK:
+        return {name: metric.to_dict() for name, metric in sorted(REGISTRY.items())}
+
+
+def to_json() -> str:
+    "Returns all metrics as JSON"
+    return json.dumps(to_dict(), indent=2)
+
+
+def _prometheus_histogram(
+    lines: list, family: str, name: str, counts: list, buckets: tuple, total: float
+) -> None:
+    cumulative = 0
+    for bound, count in zip([str(b) for b in buckets] + ["+Inf"], counts):
+        cumulative += count
+        lines.append(f'{family}_bucket{{name="{name}",le="{bound}"}} {cumulative}')
+    lines.append(f'{family}_sum{{name="{name}"}} {total}')
+    lines.append(f'{family}_count{{name="{name}"}} {cumulative}')
+
+
+def to_prometheus() -> str:
+    "Returns all metrics in Prometheus text exposition format"
+    with _LOCK:
+        metrics = sorted(REGISTRY.items())
+        lines = ["# TYPE awesomebudget_latency_ms histogram"]
+        for name, metric in metrics:
+            _prometheus_histogram(
+                lines,
+                "awesomebudget_latency_ms",
+                name,
+                metric.latency,
+                LATENCY_BUCKETS_MS,
+                metric.total_ms,
+            )
+        lines.append("# TYPE awesomebudget_payload_size histogram")
+        for name, metric in metrics:
+            if metric.sized:
+                _prometheus_histogram(
+                    lines,
+                    "awesomebudget_payload_size",
+                    name,
+                    metric.sizes,
+                    SIZE_BUCKETS,
+                    metric.total_size,
+                )
+    return "\n".join(lines) + "\n"
@@ -1,18 +1,61 @@
 """
 Functions to deal with Nordigen Open Banking APIs
-Includes token encryption/decryption.
+Includes token encryption/decryption with the cypher from src.crypto.
 """
 
-import base64
+import hashlib
 import sqlite3
-from datetime import datetime, timedelta
-from os import path
+import time
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+from os import environ, path
 
 import pandas as pd
 import requests
 from cryptography.fernet import Fernet
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+
+from src.cache import on_sync
+from src.instrumentation import connect, instrumented, timer
+from src.storage import connect_user
+
+
+# Point at a stand-in server, e.g. benchmarks/mock_nordigen.py, to work offline
+NORDIGEN_URL = environ.get("NORDIGEN_URL", "https://ob.nordigen.com")
+
+# Times a rate limited (HTTP 429) GET is retried before giving up
+MAX_RETRIES = 3
+
+# Longest Retry-After in seconds worth waiting for, longer ones return the 429
+MAX_RETRY_WAIT = 10
+
+# _normalise_transactions column -> transactions table column
+TRANSACTION_COLUMNS = {
+    "transactionId": "transaction_id",
+    "bookingDate": "booking_date",
+    "valueDate": "value_date",
+    "transactionAmount_amount": "amount",
+    "transactionAmount_currency": "currency",
+    "creditorName": "creditor_name",
+    "debtorName": "debtor_name",
+    "remittanceInformationUnstructured": "description",
+    "status": "status",
+}
+
+
+# Decimal places of the minor unit where it isn't 2, see ISO 4217
+CURRENCY_EXPONENTS = {
+    "BHD": 3,
+    "CLP": 0,
+    "ISK": 0,
+    "JOD": 3,
+    "JPY": 0,
+    "KRW": 0,
+    "KWD": 3,
+    "OMR": 3,
+    "TND": 3,
+}
+
+_EPOCH = pd.Timestamp("1970-01-01")
 
 
 class NoTokenError(Exception):
@@ -27,21 +70,12 @@ class InvalidEndpointError(Exception):
     "should be raised for any API error due to invalid Json values"
 
 
-def generate_fernet(salt: bytes, password: str) -> Fernet:
-    """
-    Generates a Fernet cypher from a given salt and password
-
-    :param salt: a fixed salt
-    :param password: password to use
-    :returns: The Fernet cypherwith base64 url
+class RateLimitError(Exception):
+    "should be raised when Nordigen still rate limits a request after retrying"
 
-    :note: This function is deterministic so should always
-    return the same cypher from the same salt and password
-    """
-    kdf = PBKDF2HMAC(algorithm=hashes.SHA256(), length=32, salt=salt, iterations=390000)
-    return Fernet(
-        base64.urlsafe_b64encode(kdf.derive(bytes(password, encoding="utf8")))
-    )
+    def __init__(self, url: str, retry_after: float):
+        super().__init__(f"{url} is rate limited, retry after {retry_after:.0f}s")
+        self.retry_after = retry_after
 
 
 def request_token(secret_id: str, secret_key: str) -> dict:
@@ -57,11 +91,13 @@ def request_token(secret_id: str, secret_key: str) -> dict:
         "secret_id": secret_id,
         "secret_key": secret_key,
     }
-    res = requests.post(
-        "https://ob.nordigen.com/api/v2/token/new/",
-        headers={"accept": "application/json", "Content-Type": "application/json"},
-        json=json,
-    )
+    with timer("nordigen.token.new") as t:
+        res = requests.post(
+            f"{NORDIGEN_URL}/api/v2/token/new/",
+            headers={"accept": "application/json", "Content-Type": "application/json"},
+            json=json,
+        )
+        t.size = len(res.content)
     data = res.json()
     data.update(
         {
@@ -90,7 +126,7 @@ def save_token(
     :return: True if successful
     """
 
-    with sqlite3.connect(db, detect_types=sqlite3.PARSE_DECLTYPES) as conn:
+    with connect(db, detect_types=sqlite3.PARSE_DECLTYPES) as conn:
         c = conn.cursor()
         c.execute(
             """REPLACE INTO tokens(id, access, access_expires, refresh, refresh_expires)
@@ -120,11 +156,13 @@ def refresh_token(token: dict) -> dict:
         raise ExpiredTokenError
 
     json = {"refresh": token["refresh"]}
-    res = requests.post(
-        "https://ob.nordigen.com/api/v2/token/refresh/",
-        headers={"accept": "application/json", "Content-Type": "application/json"},
-        json=json,
-    )
+    with timer("nordigen.token.refresh") as t:
+        res = requests.post(
+            f"{NORDIGEN_URL}/api/v2/token/refresh/",
+            headers={"accept": "application/json", "Content-Type": "application/json"},
+            json=json,
+        )
+        t.size = len(res.content)
     data = res.json()
     token.update({"access": data["access"]})
     token.update(
@@ -146,7 +184,7 @@ def load_token(cypher: Fernet, db: path = path.join(".db", "awesomebudget.db"))
     :raises ValueError: If there is no token to load
     """
 
-    with sqlite3.connect(db, detect_types=sqlite3.PARSE_DECLTYPES) as conn:
+    with connect(db, detect_types=sqlite3.PARSE_DECLTYPES) as conn:
         c = conn.cursor()
         c.execute("SELECT * from tokens")
         query = c.fetchone()
@@ -170,6 +208,73 @@ def manage_token():
     raise NotImplementedError
 
 
+def _retry_after(res: requests.Response) -> float:
+    """
+    Seconds a rate limited response asks to wait before retrying
+
+    :param res: HTTP 429 response
+    :returns: Retry-After in seconds, given as seconds or as an HTTP-date,
+    1 if missing or malformed
+    """
+    value = res.headers.get("Retry-After", "1")
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return 1
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0)
+
+
+def _get(metric: str, url: str, token: dict, **kwargs) -> requests.Response:
+    """
+    GETs a Nordigen endpoint, retrying rate limited (429) responses after Retry-After.
+    Waits longer than MAX_RETRY_WAIT aren't slept through, as they'd block the
+    Streamlit script thread.
+
+    :param metric: instrumentation metric name
+    :param url: endpoint url
+    :param token: Nordigen API token
+    :param kwargs: passed through to requests.get
+    :returns: the first response that isn't a 429, callers check its status
+    :raises RateLimitError: if retries run out or Retry-After exceeds MAX_RETRY_WAIT
+    """
+    for attempt in range(MAX_RETRIES + 1):
+        with timer(metric) as t:
+            res = requests.get(
+                url,
+                headers={
+                    "accept": "application/json",
+                    "Authorization": "Bearer " + token["access"],
+                },
+                **kwargs,
+            )
+            t.size = len(res.content)
+        if res.status_code != 429:
+            return res
+        wait = _retry_after(res)
+        if attempt == MAX_RETRIES or wait > MAX_RETRY_WAIT:
+            raise RateLimitError(url, wait)
+        time.sleep(wait)
+
+
+def _json(res: requests.Response):
+    """
+    Decodes a Nordigen response
+
+    :param res: response returned by _get
+    :returns: the decoded Json body
+    :raises InvalidEndpointError: if the response is an error
+    """
+    if not res.ok:
+        raise InvalidEndpointError(f"{res.url}: {res.status_code} {res.text}")
+    return res.json()
+
+
 def get_providers(token: str, country: str) -> pd.DataFrame:
     """
     queries the nordigen API for compatible banks
@@ -178,12 +283,10 @@ def get_providers(token: str, country: str) -> pd.DataFrame:
     :param country: 2-letter uppercase ISO code for a country (str)
     :returns:  exploded pd.DataFrame with compatible financial insitutions
     """
-    res = requests.get(
-        "https://ob.nordigen.com/api/v2/institutions",
-        headers={
-            "accept": "application/json",
-            "Authorization": "Bearer " + token["access"],
-        },
+    res = _get(
+        "nordigen.institutions",
+        f"{NORDIGEN_URL}/api/v2/institutions",
+        token,
         params={"country": country},
     )
     if res.status_code != 200:
@@ -209,7 +312,7 @@ def save_requisition(
     :param db: path to sqlite db, defaults to path.join(".db", "awesomebudget.db")
     :returns: True if successful
     """
-    with sqlite3.connect(db) as conn:
+    with connect_user(username, db) as conn:
         c = conn.cursor()
 
         c.execute("SELECT id FROM users WHERE username = ?;", (username,))
@@ -234,7 +337,7 @@ def load_requisitions(
     :param db: path to sqlite db, defaults to path.join(".db", "awesomebudget.db")
     :returns: tuple of requistions associated with the given user
     """
-    with sqlite3.connect(db) as conn:
+    with connect_user(username, db) as conn:
         c = conn.cursor()
         c.execute(
             """
@@ -267,23 +370,26 @@ def delete_requision(
     """
     # delete from Nordigen backend
     if not local_only:
-        res = requests.delete(
-            f"https://ob.nordigen.com/api/v2/requisitions/{requisition_id}/",
-            headers={
-                "Authorization": "Bearer " + token["access"],
-                "accept": "application/json",
-                "Content-Type": "application/json",
-            },
-        )
+        with timer("nordigen.requisitions.delete") as t:
+            res = requests.delete(
+                f"{NORDIGEN_URL}/api/v2/requisitions/{requisition_id}/",
+                headers={
+                    "Authorization": "Bearer " + token["access"],
+                    "accept": "application/json",
+                    "Content-Type": "application/json",
+                },
+            )
+            t.size = len(res.content)
         if not res.ok:
             raise ValueError("invalid requisition ID or token")
-    with sqlite3.connect(db) as conn:
+    with connect_user(username, db) as conn:
         c = conn.cursor()
         c.execute(
-            """DELETE from requisitions
-                WHERE users_id IN (SELECT user_id from users WHERE username = (?))""",
-            (username,),
+            """DELETE from requisitions WHERE requisition_id = (?)
+                AND users_id IN (SELECT id from users WHERE username = (?))""",
+            (requisition_id, username),
         )
+    on_sync(username)
     return True
 
 
@@ -307,15 +413,19 @@ def create_requisition(
         "institution_id": institution_id,
         "redirect": f"http://localhost:8501/?token={token['access']}",
     }
-    res = requests.post(
-        "https://ob.nordigen.com/api/v2/requisitions/",
-        headers={
-            "Authorization": "Bearer " + token["access"],
-            "accept": "application/json",
-            "Content-Type": "application/json",
-        },
-        json=json,
-    )
+    with timer("nordigen.requisitions.create") as t:
+        res = requests.post(
+            f"{NORDIGEN_URL}/api/v2/requisitions/",
+            headers={
+                "Authorization": "Bearer " + token["access"],
+                "accept": "application/json",
+                "Content-Type": "application/json",
+            },
+            json=json,
+        )
+        t.size = len(res.content)
+    if not res.ok:
+        raise ValueError(f"requisition not created: {res.status_code} {res.text}")
     created_at = datetime.strptime(res.json()["created"], "%Y-%m-%dT%H:%M:%S.%f%z")
     requisition = {
         "username": username,
@@ -331,6 +441,7 @@ def save_account(
     account_id: str,
     requisition_id: str,
     db: path = path.join(".db", "awesomebudget.db"),
+    username: str = None,
 ):
     """
     Saves the selected account into the DB
@@ -338,9 +449,10 @@ def save_account(
     :param account_id: Nordigen id for the account to save
     :param requisition_id: Nordigen id for requisition associated with the accounts
     :param db: path to sqlite db, defaults to path.join(".db", "awesomebudget.db")
+    :param username: user owning the account, required if SHARDED
     :return: True if saved successfully
     """
-    with sqlite3.connect(db) as conn:
+    with connect_user(username, db) as conn:
         c = conn.cursor()
         c.execute(
             """INSERT INTO accounts(account_id, requisition_id) values
@@ -359,18 +471,180 @@ def load_accounts(username: str, db: path = path.join(".db", "awesomebudget.db")
     :param db: path to sqlite db, defaults to path.join(".db", "awesomebudget.db")
     :return: list of DB rows
     """
-    with sqlite3.connect(db) as conn:
+    with connect_user(username, db) as conn:
         c = conn.cursor()
         c.execute(
             """
-        SELECT * FROM accounts WHERE user_id IN (
-            SELECT id FROM users WHERE username = (?))
+        SELECT accounts.* FROM accounts
+        JOIN requisitions ON requisitions.id = accounts.requisition_id
+        JOIN users ON users.id = requisitions.users_id WHERE username = (?)
         """,
             (username,),
         )
         return c.fetchall()
 
 
+def save_transactions(
+    account_id: str,
+    transactions: pd.DataFrame,
+    db: path = path.join(".db", "awesomebudget.db"),
+    username: str = None,
+) -> int:
+    """
+    Saves normalised transactions for an account, updating already saved ones.
+    Transactions are matched on _transaction_keys, so syncing again is idempotent.
+    Pending transactions are replaced wholesale as they may change before booking.
+
+    :param account_id: Nordigen id for the account the transactions belong to
+    :param transactions: DataFrame as returned by get_transasctions
+    :param db: path to sqlite db, defaults to path.join(".db", "awesomebudget.db")
+    :param username: user owning the account, required if SHARDED
+    :return: number of transactions saved
+    """
+    if is_compact(transactions):
+        transactions = expand_transactions(transactions)
+    df = transactions.reindex(columns=list(TRANSACTION_COLUMNS))
+    df["bookingDate"] = df["bookingDate"].fillna(df["valueDate"])
+    for column in ("bookingDate", "valueDate"):
+        df[column] = pd.to_datetime(df[column]).dt.strftime("%Y-%m-%d")
+    df["transactionAmount_amount"] = df["transactionAmount_amount"].astype(float)
+    df["transactionId"] = _transaction_keys(transactions, df)
+    rows = df.astype(object).where(df.notna(), None).itertuples(index=False)
+    columns = ", ".join(TRANSACTION_COLUMNS.values())
+    updates = ", ".join(f"{c} = excluded.{c}" for c in TRANSACTION_COLUMNS.values())
+
+    with connect_user(username, db) as conn:
+        c = conn.cursor()
+        c.execute("SELECT id FROM accounts WHERE account_id = ?", (account_id,))
+        account = c.fetchone()[0]
+        c.execute(
+            "DELETE FROM transactions WHERE account_id = ? AND status = 'pending'",
+            (account,),
+        )
+        c.executemany(
+            f"""INSERT INTO transactions(account_id, {columns})
+            VALUES(?,?,?,?,?,?,?,?,?,?)
+            ON CONFLICT(account_id, transaction_id) DO UPDATE SET {updates}""",
+            ((account, *row) for row in rows),
+        )
+        conn.commit()
+    return len(df)
+
+
+def _transaction_keys(transactions: pd.DataFrame, df: pd.DataFrame) -> list:
+    """
+    Dedup key of each transaction, stored in transactions.transaction_id.
+    transactionId is optional in Nordigen, so rows without one fall back to
+    internalTransactionId, then to a hash of their fields numbered by occurrence,
+    which keeps identical transactions apart and matches them again on re-sync.
+
+    :param transactions: DataFrame as passed to save_transactions
+    :param df: the same transactions reindexed to TRANSACTION_COLUMNS,
+    dates as ISO strings and amounts as floats
+    :returns: list of keys in row order
+    """
+    df = df.reset_index(drop=True)
+    keys = df["transactionId"].astype("string")
+    if "internalTransactionId" in transactions:
+        internal = transactions["internalTransactionId"].astype("string")
+        keys = keys.fillna("internal:" + internal.reset_index(drop=True))
+    missing = keys.isna()
+    if missing.any():
+        fields = df.loc[missing].drop(columns="transactionId").astype(object)
+        digests = pd.Series(
+            [
+                hashlib.sha1("|".join(map(str, row)).encode()).hexdigest()
+                for row in fields.where(fields.notna(), "").itertuples(index=False)
+            ],
+            fields.index,
+            dtype="string",
+        )
+        occurrence = digests.groupby(digests).cumcount().astype("string")
+        keys = keys.fillna("hash:" + digests + ":" + occurrence)
+    return keys.tolist()
+
+
+def load_transactions_page(
+    username: str,
+    after: tuple = None,
+    page_size: int = 50,
+    account_id: str = None,
+    category: int = None,
+    status: str = None,
+    min_amount: float = None,
+    max_amount: float = None,
+    search: str = None,
+    db: path = path.join(".db", "awesomebudget.db"),
+) -> tuple:
+    """
+    Loads one page of a user's transactions, newest first.
+    Keyset paginated on (booking_date, id) so every page costs the same
+    regardless of how deep into the history it is; all filters run in SQL.
+
+    :param username: username to load transactions for
+    :param after: cursor returned with the previous page, None for the first page
+    :param page_size: number of transactions per page
+    :param account_id: only load transactions of this Nordigen account id
+    :param category: only load transactions with this categories id
+    :param status: only load "booked" or "pending" transactions
+    :param min_amount: only load transactions with at least this amount
+    :param max_amount: only load transactions with at most this amount
+    :param search: only load transactions whose description contains this string
+    :param db: path to sqlite db, defaults to path.join(".db", "awesomebudget.db")
+    :returns: (DataFrame in _normalise_transactions format plus a categories_id
+    column, cursor for the next page or None if this is the last page)
+    """
+    # resolve the user's accounts first so transactions_account_date is used
+    # and pages don't get slower as other users' history grows
+    accounts = """transactions.account_id IN (
+        SELECT accounts.id FROM accounts
+        JOIN requisitions ON requisitions.id = accounts.requisition_id
+        JOIN users ON users.id = requisitions.users_id
+        WHERE users.username = ?{})"""
+    where = [accounts.format(" AND accounts.account_id = ?" if account_id else "")]
+    params = [username, account_id] if account_id else [username]
+    filters = {
+        "transactions.categories_id = ?": category,
+        "transactions.status = ?": status,
+        "transactions.amount >= ?": min_amount,
+        "transactions.amount <= ?": max_amount,
+        "instr(lower(transactions.description), lower(?)) > 0": search or None,
+        "(transactions.booking_date, transactions.id) < (?, ?)": after,
+    }
+    for clause, value in filters.items():
+        if value is not None:
+            where.append(clause)
+            params.extend(value if isinstance(value, tuple) else (value,))
+    columns = ", ".join(f"transactions.{c}" for c in TRANSACTION_COLUMNS.values())
+
+    with connect_user(username, db) as conn:
+        c = conn.cursor()
+        c.execute(
+            f"""
+            SELECT transactions.id, {columns}, transactions.categories_id
+            FROM transactions
+            WHERE {" AND ".join(where)}
+            ORDER BY transactions.booking_date DESC, transactions.id DESC
+            LIMIT ?
+            """,
+            (*params, page_size + 1),
+        )
+        rows = c.fetchall()
+
+    page = pd.DataFrame(
+        rows[:page_size],
+        columns=["id", *TRANSACTION_COLUMNS, "categories_id"],
+    ).set_index("id")
+    cursor = None
+    if len(rows) > page_size:
+        cursor = (page["bookingDate"].iloc[-1], int(page.index[-1]))
+    page = page.assign(
+        bookingDate=lambda x: pd.to_datetime(x["bookingDate"]),
+        valueDate=lambda x: pd.to_datetime(x["valueDate"]),
+    )
+    return page, cursor
+
+
 def get_accounts(token: dict, requisition_id: str) -> dict:
     """
     Gets all accounts associated with a given requisition
@@ -378,35 +652,38 @@ def get_accounts(token: dict, requisition_id: str) -> dict:
     :paramn token: Nordigen API token
     :param requisition_id: requisition_id of the requisition to query
     :returns: A dict with the accounts associated with the requisition
+    :raises InvalidEndpointError: if Nordigen answers with an error
+    :raises RateLimitError: if Nordigen keeps rate limiting the request
     """
-    res = requests.get(
-        f"https://ob.nordigen.com/api/v2/requisitions/{requisition_id}/",
-        headers={
-            "accept": "application/json",
-            "Authorization": "Bearer " + token["access"],
-        },
+    res = _get(
+        "nordigen.requisitions.get",
+        f"{NORDIGEN_URL}/api/v2/requisitions/{requisition_id}/",
+        token,
     )
 
-    accounts = {"requisition_id": res.json()["id"], "ids": res.json()["accounts"]}
+    data = _json(res)
+    accounts = {"requisition_id": data["id"], "ids": data["accounts"]}
     return accounts
 
 
-def get_transasctions(token: dict, account_id: str):
+def get_transasctions(token: dict, account_id: str, compact: bool = True):
     """
     Get transactions for a given account
 
     :param token: Nordigen API token
     :param account_id: Nordigen account ID to get transactions for
-    :returns: A dict with transactions as per NORDIGEN Schema
-    """
-    res = requests.get(
-        f"https://ob.nordigen.com/api/v2/accounts/{account_id}/transactions",
-        headers={
-            "accept": "application/json",
-            "Authorization": "Bearer " + token["access"],
-        },
+    :param compact: whether to return the compact representation (compact_transactions)
+    :returns: A normalised df with transactions as per NORDIGEN Schema
+    :raises InvalidEndpointError: if Nordigen answers with an error
+    :raises RateLimitError: if Nordigen keeps rate limiting the request
+    """
+    res = _get(
+        "nordigen.transactions",
+        f"{NORDIGEN_URL}/api/v2/accounts/{account_id}/transactions",
+        token,
     )
-    return _normalise_transactions(res.json())
+    transactions = _normalise_transactions(_json(res))
+    return compact_transactions(transactions) if compact else transactions
 
 
 def get_balance(token: dict, account_id: str) -> pd.DataFrame:
@@ -415,17 +692,17 @@ def get_balance(token: dict, account_id: str) -> pd.DataFrame:
     :param token: Nordigen API token
     :param account_id: Nordigen account ID to get transactions for
     :returns: A normalised df with balances
+    :raises InvalidEndpointError: if Nordigen answers with an error
+    :raises RateLimitError: if Nordigen keeps rate limiting the request
     """
-    res = requests.get(
-        f"https://ob.nordigen.com/api/v2/accounts/{account_id}/balances",
-        headers={
-            "accept": "application/json",
-            "Authorization": "Bearer " + token["access"],
-        },
+    res = _get(
+        "nordigen.balances",
+        f"{NORDIGEN_URL}/api/v2/accounts/{account_id}/balances",
+        token,
     )
     # Return normalised DF
     return (
-        pd.json_normalize(res.json()["balances"])
+        pd.json_normalize(_json(res)["balances"])
         .rename(columns=lambda x: str.replace(x, ".", "_"))
         .assign(
             referenceDate=lambda x: pd.to_datetime(x["referenceDate"]),
@@ -445,6 +722,66 @@ def get_account_data(token: dict, account_id: str) -> dict:
     return data
 
 
+def save_balance(
+    account_id: str,
+    balance: pd.DataFrame,
+    db: path = path.join(".db", "awesomebudget.db"),
+    username: str = None,
+) -> int:
+    """
+    Saves an account's balance, in minor units, as checked now
+
+    :param account_id: Nordigen id for the account the balance belongs to
+    :param balance: DataFrame as returned by get_balance, the first balance is saved
+    :param db: path to sqlite db, defaults to path.join(".db", "awesomebudget.db")
+    :param username: user owning the account, required if SHARDED
+    :returns: saved balance in minor units
+    """
+    scale = minor_unit_scale(balance["balanceAmount_currency"])
+    amount = int(round(balance["balanceAmount_amount"].iloc[0] * scale.iloc[0]))
+    with connect_user(username, db) as conn:
+        conn.execute(
+            """INSERT INTO balance(account_id, balance, last_checked)
+            VALUES((SELECT id FROM accounts WHERE account_id = ?), ?, ?)""",
+            (account_id, amount, datetime.now()),
+        )
+    return amount
+
+
+def sync_account(
+    token: dict,
+    account_id: str,
+    db: path = path.join(".db", "awesomebudget.db"),
+    username: str = None,
+) -> int:
+    """
+    Fetches an account's balance and transactions, saves them to db
+    and drops the account's cached data
+
+    :param token: Nordigen API token
+    :param account_id: Nordigen account ID to sync
+    :param db: path to sqlite db, defaults to path.join(".db", "awesomebudget.db")
+    :param username: user owning the account, required if SHARDED
+    :returns: number of transactions saved
+    """
+    data = get_account_data(token, account_id)
+    save_balance(account_id, data["balance"], db, username)
+    saved = save_transactions(account_id, data["transactions"], db, username)
+    if username is None:
+        with connect(db) as conn:
+            c = conn.cursor()
+            c.execute(
+                """SELECT users.username FROM accounts
+                JOIN requisitions ON requisitions.id = accounts.requisition_id
+                JOIN users ON users.id = requisitions.users_id
+                WHERE accounts.account_id = ?""",
+                (account_id,),
+            )
+            (username,) = c.fetchone()
+    on_sync(username, account_id)
+    return saved
+
+
 def _normalise_transactions(transactions: dict) -> pd.DataFrame:
     """
     Normalise transactions from json
@@ -470,3 +807,93 @@ def _normalise_transactions(transactions: dict) -> pd.DataFrame:
         .convert_dtypes()
     )
     return table
+
+
+def is_compact(transactions: pd.DataFrame) -> bool:
+    """
+    Whether transactions are in the compact representation
+
+    :param transactions: DataFrame as returned by get_transasctions
+    :returns: True if dates are stored as day numbers
+    """
+    return pd.api.types.is_integer_dtype(transactions["bookingDate"])
+
+
+def minor_unit_scale(currency: pd.Series) -> pd.Series:
+    """
+    Number of minor units in a major unit for each currency code
+
+    :param currency: series of ISO 4217 currency codes
+    :returns: series of int64 scales, e.g. 100 for EUR and 1 for JPY
+    """
+    exponents = currency.astype(object).map(CURRENCY_EXPONENTS).fillna(2)
+    return (10 ** exponents).astype("int64")
+
+
+def to_day_numbers(dates: pd.Series) -> pd.Series:
+    """
+    Converts dates to days since 1970-01-01
+
+    :param dates: series of dates
+    :returns: nullable Int32 series of day numbers
+    """
+    days = (pd.to_datetime(dates) - _EPOCH).dt.days
+    return days.astype("Int32")
+
+
+def from_day_numbers(days: pd.Series) -> pd.Series:
+    """
+    Converts days since 1970-01-01 back to dates
+
+    :param days: series of day numbers
+    :returns: datetime64 series
+    """
+    return pd.to_datetime(days.astype("float64"), unit="D")
+
+
+def compact_transactions(transactions: pd.DataFrame) -> pd.DataFrame:
+    """
+    Converts normalised transactions to a compact representation:
+    amounts as int64 minor units (cents), dates as Int32 days since 1970-01-01
+    and low cardinality string columns as categoricals.
+    Column names are unchanged so it can be used wherever transactions are expected.
+
+    :param transactions: DataFrame as returned by _normalise_transactions
+    :returns: compact DataFrame with a RangeIndex
+    """
+    df = transactions.reset_index(drop=True)
+    currency = df["transactionAmount_currency"]
+    amount = df["transactionAmount_amount"].astype("float64")
+    df["transactionAmount_amount"] = (
+        (amount * minor_unit_scale(currency)).round().astype("int64")
+    )
+    for column in ("bookingDate", "valueDate"):
+        if column in df:
+            df[column] = to_day_numbers(df[column])
+    for column in df.columns:
+        values = df[column]
+        # dictionary encoding only pays off when values repeat
+        if values.dtype == "string" and values.nunique() <= len(values) / 2:
+            df[column] = values.astype("category")
+    return df
+
+
+def expand_transactions(transactions: pd.DataFrame) -> pd.DataFrame:
+    """
+    Converts compact transactions back to the _normalise_transactions representation
+
+    :param transactions: DataFrame as returned by compact_transactions
+    :returns: DataFrame with float amounts, datetime dates and string columns
+    """
+    df = transactions.copy()
+    currency = df["transactionAmount_currency"]
+    df["transactionAmount_amount"] = df["transactionAmount_amount"] / minor_unit_scale(
+        currency
+    )
+    for column in ("bookingDate", "valueDate"):
+        if column in df:
+            df[column] = from_day_numbers(df[column])
+    for column in df.columns:
+        if df[column].dtype == "category":
+            df[column] = df[column].astype("string")
+    return df
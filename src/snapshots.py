@@ -0,0 +1,250 @@
+"""
+Columnar Parquet snapshots of transaction history,
+for offline analysis and fast cold starts.
+
+Snapshots are hive partitioned by account and booking month:
+    <root>/account=<Nordigen account id>/month=<YYYY-MM>/part-0.parquet
+Within a month file each category gets its own row groups, sorted by date, so
+row group statistics let category and date filters skip most of the data on
+reload. Accounts are written to a temporary directory and renamed into place,
+so a failed export leaves the previous snapshot in place.
+"""
+
+import shutil
+import tempfile
+from datetime import date
+from itertools import chain, groupby, islice
+from os import makedirs, path, rename
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from pyarrow import fs
+
+from src import utils
+from src.instrumentation import connect
+from src.storage import connect_user
+
+# Arrow schema of _normalise_transactions columns, plus the db id and category
+SNAPSHOT_SCHEMA = pa.schema(
+    [
+        ("id", pa.int64()),
+        ("transactionId", pa.string()),
+        ("bookingDate", pa.date32()),
+        ("valueDate", pa.date32()),
+        ("transactionAmount_amount", pa.float64()),
+        ("transactionAmount_currency", pa.dictionary(pa.int32(), pa.string())),
+        ("creditorName", pa.string()),
+        ("debtorName", pa.string()),
+        ("remittanceInformationUnstructured", pa.string()),
+        ("status", pa.dictionary(pa.int32(), pa.string())),
+        ("categories_id", pa.int32()),
+    ]
+)
+
+PARTITIONING = ds.partitioning(
+    pa.schema([("account", pa.string()), ("month", pa.string())]), flavor="hive"
+)
+
+
+def _to_batch(rows: list) -> pa.RecordBatch:
+    """
+    Converts transactions table rows to an Arrow record batch
+
+    :param rows: rows in SNAPSHOT_SCHEMA column order, dates as ISO strings
+    :returns: RecordBatch with SNAPSHOT_SCHEMA
+    """
+    columns = list(zip(*rows))
+    arrays = []
+    for field, values in zip(SNAPSHOT_SCHEMA, columns):
+        if pa.types.is_date32(field.type):
+            values = [date.fromisoformat(x) if x else None for x in values]
+        if pa.types.is_dictionary(field.type):
+            arrays.append(pa.array(values, pa.string()).dictionary_encode())
+        else:
+            arrays.append(pa.array(values, field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=SNAPSHOT_SCHEMA)
+
+
+def _write_account(root: path, account: str, rows, row_group_size: int) -> int:
+    """
+    Writes one account's rows to a temporary directory, then swaps it in place
+    of the account's previous snapshot with two renames. Readers opening the
+    snapshot between them briefly see no data for the account, a failure at any
+    point leaves the previous snapshot in place
+
+    :param root: snapshot directory
+    :param account: Nordigen account id
+    :param rows: account id followed by SNAPSHOT_SCHEMA columns, sorted by month,
+    category and date
+    :param row_group_size: maximum rows per Parquet row group
+    :returns: number of transactions written
+    """
+    category = SNAPSHOT_SCHEMA.get_field_index("categories_id")
+    account_dir = path.join(root, f"account={account}")
+    # dot prefixed directories are ignored by open_snapshot
+    tmp_dir = tempfile.mkdtemp(prefix=f".account={account}.", dir=root)
+    old_dir = f"{tmp_dir}.old"
+    written = 0
+    try:
+        for month, month_rows in groupby(rows, key=lambda x: x[3][:7]):
+            month_dir = path.join(tmp_dir, f"month={month}")
+            makedirs(month_dir)
+            month_rows = (row[1:] for row in month_rows)
+            with pq.ParquetWriter(
+                path.join(month_dir, "part-0.parquet"), SNAPSHOT_SCHEMA
+            ) as writer:
+                # every write_table call starts a new row group
+                for _, group in groupby(month_rows, key=lambda x: x[category]):
+                    for chunk in iter(lambda: list(islice(group, row_group_size)), []):
+                        writer.write_table(
+                            pa.Table.from_batches([_to_batch(chunk)]),
+                            row_group_size=row_group_size,
+                        )
+                        written += len(chunk)
+        if path.exists(account_dir):
+            rename(account_dir, old_dir)
+        try:
+            rename(tmp_dir, account_dir)
+        except BaseException:
+            if path.exists(old_dir):
+                rename(old_dir, account_dir)
+            raise
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    shutil.rmtree(old_dir, ignore_errors=True)
+    return written
+
+
+def export_snapshot(
+    root: path,
+    username: str = None,
+    row_group_size: int = 64 * 1024,
+    db: path = path.join(".db", "awesomebudget.db"),
+) -> int:
+    """
+    Writes saved transactions to a partitioned Parquet snapshot, replacing any
+    previous snapshot of the exported accounts.
+    Rows are streamed from sqlite one row group at a time so memory stays bounded.
+
+    :param root: snapshot directory
+    :param username: only export this user's accounts, defaults to all accounts
+    :param row_group_size: maximum rows per Parquet row group, categories always
+    start a new row group
+    :param db: path to sqlite db, defaults to path.join(".db", "awesomebudget.db")
+    :returns: number of transactions written
+    """
+    if utils.SHARDED and not username:
+        # each user's transactions live in their own shard
+        with connect(db) as conn:
+            usernames = [x[0] for x in conn.execute("SELECT username FROM users")]
+        return sum(export_snapshot(root, x, row_group_size, db) for x in usernames)
+    columns = ", ".join(
+        [
+            "transactions.id",
+            "transactions.transaction_id",
+            "transactions.booking_date",
+            "transactions.value_date",
+            "transactions.amount",
+            "transactions.currency",
+            "transactions.creditor_name",
+            "transactions.debtor_name",
+            "transactions.description",
+            "transactions.status",
+            "transactions.categories_id",
+        ]
+    )
+    where = "WHERE users.username = ?" if username else ""
+    written = 0
+    makedirs(root, exist_ok=True)
+    with connect_user(username, db) as conn:
+        c = conn.cursor()
+        c.execute(
+            f"""
+            SELECT accounts.account_id, {columns} FROM transactions
+            JOIN accounts ON accounts.id = transactions.account_id
+            JOIN requisitions ON requisitions.id = accounts.requisition_id
+            JOIN users ON users.id = requisitions.users_id {where}
+            ORDER BY accounts.account_id, substr(transactions.booking_date, 1, 7),
+            transactions.categories_id, transactions.booking_date, transactions.id
+            """,
+            (username,) if username else (),
+        )
+        rows = chain.from_iterable(iter(lambda: c.fetchmany(row_group_size), []))
+        for account, account_rows in groupby(rows, key=lambda x: x[0]):
+            written += _write_account(root, account, account_rows, row_group_size)
+    return written
+
+
+def open_snapshot(root: path) -> ds.Dataset:
+    """
+    Opens a snapshot as a memory mapped Arrow dataset
+
+    :param root: snapshot directory
+    :returns: pyarrow Dataset with SNAPSHOT_SCHEMA plus account and month columns
+    """
+    return ds.dataset(
+        root,
+        schema=pa.unify_schemas([SNAPSHOT_SCHEMA, PARTITIONING.schema]),
+        format="parquet",
+        partitioning=PARTITIONING,
+        filesystem=fs.LocalFileSystem(use_mmap=True),
+    )
+
+
+def snapshot_filter(
+    account_id: str = None, category: int = None, start: date = None, end: date = None
+) -> ds.Expression:
+    """
+    Builds a dataset filter. Account and dates prune partitions,
+    category and dates prune row groups through Parquet statistics
+
+    :param account_id: only keep transactions of this Nordigen account id
+    :param category: only keep transactions with this categories id
+    :param start: only keep transactions booked on or after this date
+    :param end: only keep transactions booked on or before this date
+    :returns: filter expression, None if no filter is given
+    """
+    clauses = []
+    if account_id is not None:
+        clauses.append(ds.field("account") == account_id)
+    if category is not None:
+        clauses.append(ds.field("categories_id") == category)
+    if start is not None:
+        clauses.append(ds.field("month") >= start.strftime("%Y-%m"))
+        clauses.append(ds.field("bookingDate") >= pa.scalar(start, pa.date32()))
+    if end is not None:
+        clauses.append(ds.field("month") <= end.strftime("%Y-%m"))
+        clauses.append(ds.field("bookingDate") <= pa.scalar(end, pa.date32()))
+    expression = None
+    for clause in clauses:
+        expression = clause if expression is None else expression & clause
+    return expression
+
+
+def load_snapshot(
+    root: path,
+    columns: list = None,
+    account_id: str = None,
+    category: int = None,
+    start: date = None,
+    end: date = None,
+) -> pd.DataFrame:
+    """
+    Loads transactions from a snapshot, reading only the requested columns
+    and the partitions and row groups that can match the filters
+
+    :param root: snapshot directory
+    :param columns: columns to load, defaults to all
+    :param account_id: only load transactions of this Nordigen account id
+    :param category: only load transactions with this categories id
+    :param start: only load transactions booked on or after this date
+    :param end: only load transactions booked on or before this date
+    :returns: DataFrame in _normalise_transactions format
+    """
+    table = open_snapshot(root).to_table(
+        columns=columns, filter=snapshot_filter(account_id, category, start, end)
+    )
+    return table.to_pandas(date_as_object=False)
@@ -1,12 +1,30 @@
+from functools import lru_cache
+from os import environ, path
+
 import streamlit as st
-from typing import Callable
+
+from src import instrumentation
+from src.cache import CACHE, CacheKey, cached_call
+from src.startup import lazy_module
+from src.utils import categories
 from src.autentication import (
     AlreadyRegistredError,
     AuthenticationError,
     login,
     register,
 )
-from src.open_banking import generate_fernet
+
+# pandas, requests and sklearn are only imported once a page needs them
+open_banking = lazy_module("src.open_banking")
+categorisation = lazy_module("src.categorisation")
+
+# directory with a model saved by categorisation.serialise_model
+MODEL_DIR = environ.get("AB_MODEL_DIR", "models")
+
+
+@lru_cache(maxsize=1)
+def _load_model(model_dir: path) -> tuple:
+    return categorisation.load_model(model_dir)
 
 
 def auth_wrapper():
@@ -31,24 +49,118 @@ def auth_wrapper():
         st.error(e)
 
 
-def init_state(SECRETS):
+def init_state(fernet):
     if "auth" not in st.session_state:
         st.session_state["auth"] = None
     if "token" not in st.session_state:
         st.session_state["token"] = None
     if "fernet" not in st.session_state:
-        st.session_state.fernet = generate_fernet(
-            SECRETS[0].encode("UTF-8"), SECRETS[1],
-        )
+        # derived once per process by src.startup.init_once
+        st.session_state.fernet = fernet
 
 
 def reset_state():
+    if st.session_state.auth:
+        CACHE.invalidate(st.session_state.auth[1])
     st.session_state.auth = None
 
 
-@st.cache()
-def cache_wrapper(f, *args, **kwargs):
-    return f(*args, **kwargs)
+def transactions_page(username: str, page_size: int = 50):
+    """
+    Renders a user's transactions one page at a time.
+    Filters and pagination run in SQL so only the visible page reaches the browser.
+    """
+    st.header("Transactions")
+    accounts = [row[1] for row in open_banking.load_accounts(username)]
+    with st.expander("Filters"):
+        account = st.selectbox("Account", [None, *accounts])
+        category = st.selectbox("Category", [None, *categories])
+        status = st.selectbox("Status", [None, "booked", "pending"])
+        # bounds are opt-in so 0 works, e.g. max 0 for outflows only
+        min_amount = st.number_input("Min amount", value=0.0)
+        use_min = st.checkbox("Filter by min amount")
+        max_amount = st.number_input("Max amount", value=0.0)
+        use_max = st.checkbox("Filter by max amount")
+        search = st.text_input("Description contains")
+    filters = {
+        "account_id": account,
+        "category": categories.get(category),
+        "status": status,
+        "min_amount": min_amount if use_min else None,
+        "max_amount": max_amount if use_max else None,
+        "search": search or None,
+    }
+    # stack of cursors, one per page visited, reset whenever the filters change
+    if st.session_state.get("transaction_filters") != filters:
+        st.session_state.transaction_filters = filters
+        st.session_state.transaction_cursors = [None]
+    cursors = st.session_state.transaction_cursors
+    # reruns reuse the page until a sync or recategorisation of the account
+    key = CacheKey(
+        username, account, "transactions", (cursors[-1], page_size, *filters.items())
+    )
+    page, cursor = cached_call(
+        key,
+        open_banking.load_transactions_page,
+        username,
+        after=cursors[-1],
+        page_size=page_size,
+        **filters,
+    )
+    if (
+        len(page)
+        and path.exists(path.join(MODEL_DIR, "classifier.joblib"))
+        and st.checkbox("Suggest categories")
+    ):
+        model, vectorizer = _load_model(MODEL_DIR)
+        names = {v: k for k, v in categories.items()}
+        suggested = categorisation.predict(
+            model, vectorizer, page["remittanceInformationUnstructured"]
+        )
+        page = page.assign(suggestedCategory=suggested.map(names))
+    st.dataframe(page)
+    previous, following = st.columns(2)
+    if len(cursors) > 1 and previous.button("Previous"):
+        cursors.pop()
+        st.experimental_rerun()
+    if cursor is not None and following.button("Next"):
+        cursors.append(cursor)
+        st.experimental_rerun()
+
+
+def diagnostics_page():
+    "Renders recorded hot-path metrics, cache counters and export buttons"
+    st.header("Diagnostics")
+    enabled = st.checkbox("Record metrics", value=instrumentation.ENABLED)
+    if enabled and not instrumentation.ENABLED:
+        instrumentation.enable()
+    elif not enabled and instrumentation.ENABLED:
+        instrumentation.disable()
+    if st.button("Reset metrics"):
+        instrumentation.reset()
+    metrics = instrumentation.to_dict()
+    st.table(
+        [
+            {
+                "name": name,
+                "count": metric["count"],
+                "mean_ms": metric["mean_ms"],
+                "total_ms": metric["total_ms"],
+                "total_size": metric["total_size"],
+            }
+            for name, metric in metrics.items()
+        ]
+    )
+    with st.expander("Histograms"):
+        st.json(metrics)
+    st.subheader("Cache")
+    st.json({"entries": len(CACHE), "bytes": CACHE.size, **vars(CACHE.stats)})
+    st.download_button(
+        "Export JSON", instrumentation.to_json(), file_name="metrics.json"
+    )
+    st.download_button(
+        "Export Prometheus", instrumentation.to_prometheus(), file_name="metrics.prom"
+    )
 
 
 def login_form() -> tuple:
@@ -58,4 +170,3 @@ def login_form() -> tuple:
         st.form_submit_button(label="login")
         st.form_submit_button(label="register")
     return (user, password)
-
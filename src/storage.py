@@ -0,0 +1,209 @@
+"""
+Routes user-scoped data to per-user sqlite shards.
+
+With SHARDED off (the default) everything lives in the catalogue db as before.
+With SHARDED on (AB_SHARDED=1), users and tokens stay in the catalogue db while
+requisitions, accounts, balance, budget and transactions of each user live in
+<catalogue dir>/shards/<users.id>.db, so syncs for different users don't contend
+for the same database lock. Each shard has a one-row users table with its owner
+so user-scoped queries work unchanged in both modes.
+"""
+
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from os import link, makedirs, path, remove
+
+from src import instrumentation, utils
+from src.instrumentation import connect
+
+
+@dataclass
+class _Shard:
+    "An open shard connection and the bookkeeping ShardRouter needs to share it"
+
+    connection: object
+    # whether the connection was opened with instrumentation enabled
+    timed: bool
+    lock: threading.Lock = field(default_factory=threading.Lock)
+    # threads holding or waiting for lock, only idle shards are closed
+    users: int = 0
+
+
+class ShardRouter:
+    """
+    Maps usernames to shard files and keeps an LRU of open shard connections.
+    Each connection has a lock, so a shard is used by one thread at a time
+    while different shards are used in parallel.
+    """
+
+    def __init__(self, max_open: int = 64):
+        """
+        :param max_open: shard connections kept open, least recently used idle ones
+        are closed past it
+        """
+        self.max_open = max_open
+        self._shards = OrderedDict()  # shard path -> _Shard
+        self._paths = {}  # (catalogue db, username) -> shard path
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._shards)
+
+    def shard_path(self, username: str, db: path) -> path:
+        """
+        Returns the shard file of a user, named after their catalogue users.id,
+        creating it on first access
+
+        :param username: username to route
+        :param db: path to the catalogue db
+        :returns: path to the user's shard db
+        :raises ValueError: if the user is not registred in the catalogue
+        """
+        key = (db, username)
+        shard = self._paths.get(key)
+        if shard is not None:
+            return shard
+        with connect(db) as conn:
+            c = conn.cursor()
+            c.execute("SELECT id FROM users WHERE username = ?", (username,))
+            query = c.fetchone()
+        if not query:
+            raise ValueError(f"user: {username} is not registred")
+        shard = path.join(path.dirname(db), "shards", f"{query[0]}.db")
+        with self._lock:
+            if not path.exists(shard):
+                self._create(shard, query[0], username)
+            self._paths[key] = shard
+        return shard
+
+    @staticmethod
+    def _create(shard: path, users_id: int, username: str) -> None:
+        """
+        Builds a shard in a temporary file, then links it into place so other
+        threads and processes never open a half built shard
+        """
+        makedirs(path.dirname(shard), exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+            dir=path.dirname(shard), suffix=".db.tmp", delete=False
+        ) as tmp:
+            pass
+        try:
+            utils.create_tables(tmp.name, scope="shard")
+            conn = connect(tmp.name)
+            with conn:
+                conn.execute(
+                    "INSERT INTO users(id, username) VALUES(?,?)", (users_id, username)
+                )
+            conn.close()
+            # unlike a rename, link fails if another process created the shard first
+            link(tmp.name, shard)
+        except FileExistsError:
+            pass
+        finally:
+            remove(tmp.name)
+
+    def acquire(self, shard: path):
+        """
+        Returns the cached connection to a shard with its lock held,
+        opening it and closing idle least recently used ones as needed.
+        Idle connections opened before instrumentation was toggled are reopened.
+
+        :param shard: path to shard db
+        :returns: sqlite3 Connection, the caller must call release(shard)
+        """
+        with self._lock:
+            entry = self._shards.get(shard)
+            if entry is not None and not entry.users:
+                if entry.timed != instrumentation.ENABLED:
+                    entry.connection.close()
+                    entry = None
+            if entry is None:
+                entry = _Shard(
+                    connect(shard, check_same_thread=False), instrumentation.ENABLED
+                )
+                self._shards[shard] = entry
+            entry.users += 1
+            self._shards.move_to_end(shard)
+            self._evict()
+        entry.lock.acquire()
+        return entry.connection
+
+    def release(self, shard: path) -> None:
+        """
+        Releases a shard acquired with acquire, closing least recently used
+        idle connections past max_open
+
+        :param shard: path to shard db
+        """
+        with self._lock:
+            entry = self._shards[shard]
+            entry.users -= 1
+            entry.lock.release()
+            self._evict()
+
+    def _evict(self) -> None:
+        # called with self._lock held, shards in use are evicted once released
+        excess = len(self._shards) - self.max_open
+        for shard in list(self._shards):
+            if excess <= 0:
+                break
+            entry = self._shards[shard]
+            if not entry.users:
+                del self._shards[shard]
+                entry.connection.close()
+                excess -= 1
+
+    def close_all(self) -> None:
+        "Closes all cached connections, waiting for ones in use, and forgets all routes"
+        while True:
+            with self._lock:
+                for shard, entry in list(self._shards.items()):
+                    if not entry.users:
+                        del self._shards[shard]
+                        entry.connection.close()
+                if not self._shards:
+                    self._paths.clear()
+                    return
+            time.sleep(0.01)
+
+
+ROUTER = ShardRouter()
+
+
+def user_db(username: str, db: path = path.join(".db", "awesomebudget.db")) -> path:
+    """
+    Returns the db holding a user's data
+
+    :param username: username to route
+    :param db: path to the catalogue db
+    :returns: the user's shard if SHARDED, db otherwise
+    """
+    return ROUTER.shard_path(username, db) if utils.SHARDED else db
+
+
+@contextmanager
+def connect_user(username: str, db: path = path.join(".db", "awesomebudget.db")):
+    """
+    Connection to the db holding a user's data, committing on success.
+    Use in place of connect(db) for requisitions, accounts, balance, budget and
+    transactions.
+
+    :param username: username whose data is accessed
+    :param db: path to the catalogue db
+    :returns: a context manager yielding a sqlite3 Connection
+    """
+    if not utils.SHARDED:
+        with connect(db) as conn:
+            yield conn
+        return
+    shard = user_db(username, db)
+    conn = ROUTER.acquire(shard)
+    try:
+        with conn:
+            yield conn
+    finally:
+        ROUTER.release(shard)
@@ -2,65 +2,115 @@
 Common Helper functions
 """
 
-import sqlite3
-from os import path
+from os import environ, path
 
+from src.instrumentation import connect
 
-def create_tables(db: path = path.join(".db", "awesomebudget.db")):
+# Store user-scoped data in per-user shard files, see src/storage.py
+SHARDED = bool(environ.get("AB_SHARDED"))
+
+categories = {
+    "Entertainment": 1,
+    "Food and Drink": 2,
+    "Groceries": 3,
+    "Shopping": 4,
+    "Health": 5,
+    "Savings and investments": 6,
+    "Transport and Travel": 7,
+    "Housing, Taxes and Utilities": 8,
+    "Transfers": 9,
+    "Subscriptions and services": 10,
+    "Other": 11,
+}
+
+
+def create_tables(db: path = path.join(".db", "awesomebudget.db"), scope: str = None):
     """
     If not already present, creates all table and indices in the provided sqlite3 db
 
     :params db: path to sqlite db, defaults to path.join(".db", "awesomebudget.db")
+    :params scope: "all" tables, "catalogue" tables (users and tokens) or "shard"
+    tables (user-scoped data). Defaults to "catalogue" if SHARDED, "all" otherwise
     :returns: True if successful
     """
-    with sqlite3.connect(db) as conn:
+    scope = scope or ("catalogue" if SHARDED else "all")
+    with connect(db) as conn:
         c = conn.cursor()
-        c.execute(
-            """
-            CREATE TABLE IF NOT EXISTS users
-            (id INTEGER, user_id TEXT NOT NULL UNIQUE,
-            username TEXT NOT NULL UNIQUE, password TEXT,
-            salt BLOB NOT NULL UNIQUE, PRIMARY KEY(id))
-            """
-        )
-        c.execute(
-            """CREATE TABLE IF NOT EXISTS requisitions
-            (id INTEGER NOT NULL UNIQUE, users_id INTEGER NOT NULL, requisition_id TEXT,
-            expiry TIMESTAMP NOT NULL,
-            PRIMARY KEY(id), FOREIGN KEY(users_id) REFERENCES users(id) ON DELETE CASCADE);
-            """
-        )
-        c.execute(
-            """CREATE TABLE IF NOT EXISTS accounts
-            (id INTEGER NOT NULL UNIQUE, account_id NOT NULL UNIQUE,
-            requisition_id INTEGER NOT NULL UNIQUE,
-            PRIMARY KEY(id), FOREIGN KEY(requisition_id) REFERENCES requisitions(id)) ON DELETE CASCADEs;
-            """
-        )
-        c.execute(
-            """CREATE TABLE IF NOT EXISTS balance
-            (id INTEGER NOT NULL, account_id NOT NULL, balance INTEGER,
-            last_checked TIMESTAMP NOT NULL,
-            PRIMARY KEY(id), FOREIGN KEY(account_id) REFERENCES accounts(id) ON DELETE CASCADE)
-            """
-        )
-        c.execute(
-            """CREATE TABLE IF NOT EXISTS categories
-            (id INTEGER NOT NULL UNIQUE, category TEXT NOT NULL, PRIMARY KEY(id))
-            """
-        )
-        c.execute(
-            """CREATE TABLE IF NOT EXISTS budget
-            (id INTEGER, users_id INTEGER, categories_id INTEGER, amount NUMERIC,
-            PRIMARY KEY(id), FOREIGN KEY (categories_id) REFERENCES categories(id),
-            FOREIGN KEY(users_id) REFERENCES users(id) ON DELETE CASCADE)
-            """
-        )
-        c.execute(
-            """CREATE TABLE IF NOT EXISTS tokens (id INTEGER NOT NULL UNIQUE,
-            access BLOB NOT NULL, access_expires TIMESTAMP NOT NULL, refresh BLOB,
-            refresh_expires TIMESTAMP, PRIMARY KEY(id))
-            """
-        )
-        c.execute("CREATE UNIQUE INDEX IF NOT EXISTS users_id on users(id)")
+        if scope in ("all", "catalogue"):
+            c.execute(
+                """
+                CREATE TABLE IF NOT EXISTS users
+                (id INTEGER, user_id TEXT NOT NULL UNIQUE,
+                username TEXT NOT NULL UNIQUE, password TEXT,
+                salt BLOB NOT NULL UNIQUE, PRIMARY KEY(id))
+                """
+            )
+            c.execute(
+                """CREATE TABLE IF NOT EXISTS tokens (id INTEGER NOT NULL UNIQUE,
+                access BLOB NOT NULL, access_expires TIMESTAMP NOT NULL, refresh BLOB,
+                refresh_expires TIMESTAMP, PRIMARY KEY(id))
+                """
+            )
+            c.execute("CREATE UNIQUE INDEX IF NOT EXISTS users_id on users(id)")
+        if scope == "shard":
+            # shard owner, so user-scoped queries can keep joining on users
+            c.execute(
+                """CREATE TABLE IF NOT EXISTS users
+                (id INTEGER, username TEXT NOT NULL UNIQUE, PRIMARY KEY(id))
+                """
+            )
+        if scope in ("all", "shard"):
+            c.execute(
+                """CREATE TABLE IF NOT EXISTS requisitions
+                (id INTEGER NOT NULL UNIQUE, users_id INTEGER NOT NULL, requisition_id TEXT,
+                expiry TIMESTAMP NOT NULL,
+                PRIMARY KEY(id), FOREIGN KEY(users_id) REFERENCES users(id) ON DELETE CASCADE);
+                """
+            )
+            c.execute(
+                """CREATE TABLE IF NOT EXISTS accounts
+                (id INTEGER NOT NULL UNIQUE, account_id NOT NULL UNIQUE,
+                requisition_id INTEGER NOT NULL,
+                PRIMARY KEY(id), FOREIGN KEY(requisition_id) REFERENCES requisitions(id) ON DELETE CASCADE);
+                """
+            )
+            c.execute(
+                """CREATE TABLE IF NOT EXISTS balance
+                (id INTEGER NOT NULL, account_id NOT NULL, balance INTEGER,
+                last_checked TIMESTAMP NOT NULL,
+                PRIMARY KEY(id), FOREIGN KEY(account_id) REFERENCES accounts(id) ON DELETE CASCADE)
+                """
+            )
+            c.execute(
+                """CREATE TABLE IF NOT EXISTS categories
+                (id INTEGER NOT NULL UNIQUE, category TEXT NOT NULL, PRIMARY KEY(id))
+                """
+            )
+            c.execute(
+                """CREATE TABLE IF NOT EXISTS budget
+                (id INTEGER, users_id INTEGER, categories_id INTEGER, amount NUMERIC,
+                PRIMARY KEY(id), FOREIGN KEY (categories_id) REFERENCES categories(id),
+                FOREIGN KEY(users_id) REFERENCES users(id) ON DELETE CASCADE)
+                """
+            )
+            c.execute(
+                """CREATE TABLE IF NOT EXISTS transactions
+                (id INTEGER NOT NULL UNIQUE, account_id INTEGER NOT NULL,
+                transaction_id TEXT, booking_date DATE NOT NULL, value_date DATE,
+                amount NUMERIC NOT NULL, currency TEXT, creditor_name TEXT,
+                debtor_name TEXT, description TEXT, status TEXT NOT NULL,
+                categories_id INTEGER, UNIQUE(account_id, transaction_id),
+                PRIMARY KEY(id), FOREIGN KEY (categories_id) REFERENCES categories(id),
+                FOREIGN KEY(account_id) REFERENCES accounts(id) ON DELETE CASCADE)
+                """
+            )
+            # keyset pagination indices, see open_banking.load_transactions_page
+            c.execute(
+                """CREATE INDEX IF NOT EXISTS transactions_date
+                on transactions(booking_date, id)"""
+            )
+            c.execute(
+                """CREATE INDEX IF NOT EXISTS transactions_account_date
+                on transactions(account_id, booking_date, id)"""
+            )
         return True
@@ -0,0 +1,583 @@
+"""
+Behaviour tests, run from the repository root with
+    python -m unittest tests/tests.py
+"""
+
+import json
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta, timezone
+from email.utils import format_datetime
+from os import listdir, path, rename
+from unittest import mock
+
+import pandas as pd
+import requests
+from sklearn.feature_extraction.text import HashingVectorizer
+
+from benchmarks.mock_nordigen import MockConfig, MockNordigenServer
+from benchmarks.synthetic import generate_transactions
+from src import instrumentation, open_banking, startup, utils
+from src.analytics import monthly_totals
+from src.autentication import register
+from src.cache import CACHE, CacheKey, UserCache
+from src import snapshots
+from src.categorisation import fit_batch, predict
+from src.instrumentation import connect
+from src.storage import ROUTER, ShardRouter
+from src.utils import categories, create_tables
+
+
+class TestUserCache(unittest.TestCase):
+    def test_lru_evicts_least_recently_used_past_budget(self):
+        cache = UserCache(max_bytes=3000)
+        a, b, c = (CacheKey("bob", None, name) for name in "abc")
+        cache.set(a, "x" * 1000)
+        cache.set(b, "x" * 1000)
+        cache.get(a)
+        cache.set(c, "x" * 1000)
+        self.assertIsNotNone(cache.get(a))
+        self.assertIsNone(cache.get(b))
+        self.assertEqual(cache.stats.evictions, 1)
+        self.assertLessEqual(cache.size, cache.max_bytes)
+
+    def test_budget_counts_dataframes_inside_containers(self):
+        cache = UserCache(max_bytes=100_000)
+        df = pd.DataFrame({"x": range(20_000)})
+        self.assertFalse(cache.set(CacheKey("bob", "acc", "data"), {"df": df}))
+        self.assertFalse(cache.set(CacheKey("bob", "acc", "list"), [df]))
+        self.assertEqual(len(cache), 0)
+
+    def test_oversized_value_replaces_stale_entry(self):
+        cache = UserCache(max_bytes=100_000)
+        key = CacheKey("bob", "acc", "data")
+        cache.set(key, "old")
+        self.assertFalse(cache.set(key, "x" * 200_000))
+        self.assertIsNone(cache.get(key))
+        self.assertEqual(cache.size, 0)
+
+    def test_ttl_expires_entries(self):
+        cache = UserCache()
+        key = CacheKey("bob", "acc", "balance")
+        cache.set(key, 1, ttl=0.01)
+        self.assertEqual(cache.get(key), 1)
+        time.sleep(0.02)
+        self.assertIsNone(cache.get(key))
+        self.assertEqual(cache.stats.expirations, 1)
+
+    def test_get_or_set_counts_hits_and_misses(self):
+        cache = UserCache()
+        key = CacheKey("bob", "acc", "transactions")
+        calls = []
+        for _ in range(3):
+            cache.get_or_set(key, lambda: calls.append(1) or len(calls))
+        self.assertEqual(len(calls), 1)
+        self.assertEqual((cache.stats.hits, cache.stats.misses), (2, 1))
+
+    def test_invalidate_account_keeps_other_accounts_and_users(self):
+        cache = UserCache()
+        keys = [
+            CacheKey("bob", "acc1", "transactions"),
+            CacheKey("bob", "acc2", "transactions"),
+            CacheKey("bob", None, "analytics"),
+            CacheKey("amy", "acc3", "transactions"),
+        ]
+        for key in keys:
+            cache.set(key, 1)
+        self.assertEqual(cache.invalidate("bob", "acc1"), 2)
+        self.assertEqual([k in cache._entries for k in keys], [0, 1, 0, 1])
+
+    def test_invalidate_names_only_drops_named_entries(self):
+        cache = UserCache()
+        cache.set(CacheKey("bob", "acc", "transactions"), 1)
+        cache.set(CacheKey("bob", "acc", "categories"), 1)
+        self.assertEqual(cache.invalidate("bob", names=["categories"]), 1)
+        self.assertEqual(cache.get(CacheKey("bob", "acc", "transactions")), 1)
+
+
+def _transaction(booking_date: str, amount: str, **fields) -> dict:
+    return {
+        "bookingDate": booking_date,
+        "transactionAmount": {"amount": amount, "currency": "EUR"},
+        **fields,
+    }
+
+
+class TestTransactions(unittest.TestCase):
+    def setUp(self):
+        self.db = path.join(tempfile.mkdtemp(), "awesomebudget.db")
+        create_tables(self.db)
+        register("bob", "password", self.db)
+        open_banking.save_requisition("bob", "req", "2030-01-01", self.db)
+        open_banking.save_account("acc", "req", self.db)
+
+    def _save(self, booked: list, account: str = "acc", pending: list = None) -> None:
+        pending = pending or [
+            {**_transaction(None, "-1.00"), "valueDate": "2022-01-04"}
+        ]
+        transactions = {"transactions": {"booked": booked, "pending": pending}}
+        df = open_banking._normalise_transactions(transactions)
+        open_banking.save_transactions(account, df, self.db)
+
+    def _pages(self, page_size: int, **filters) -> list:
+        pages, cursor = [], None
+        while True:
+            page, cursor = open_banking.load_transactions_page(
+                "bob", after=cursor, page_size=page_size, db=self.db, **filters
+            )
+            pages.append(page)
+            if cursor is None:
+                return pages
+
+    def test_keyset_pages_cover_equal_booking_dates_once(self):
+        self._save(
+            [
+                _transaction("2022-01-02", "-1.00", transactionId=str(i))
+                for i in range(7)
+            ]
+            + [_transaction("2022-01-01", "-1.00", transactionId="old")]
+        )
+        pages = self._pages(page_size=3, status="booked")
+        ids = [i for page in pages for i in page.index]
+        self.assertEqual([len(page) for page in pages], [3, 3, 2])
+        self.assertEqual(len(set(ids)), 8)
+        # equal booking dates are ordered by id, newest first
+        self.assertEqual(sorted(ids[:7], reverse=True), ids[:7])
+        self.assertEqual(pages[-1]["transactionId"].iloc[-1], "old")
+
+    def test_pages_only_scan_the_users_accounts(self):
+        register("amy", "password", self.db)
+        open_banking.save_requisition("amy", "req-amy", "2030-01-01", self.db)
+        open_banking.save_account("acc-amy", "req-amy", self.db)
+        self._save(
+            [_transaction("2022-01-05", "-1.00", transactionId="amy")], "acc-amy"
+        )
+        self._save([_transaction("2022-01-01", "-2.00", transactionId="bob")])
+        (page,) = self._pages(page_size=50, status="booked")
+        self.assertEqual(list(page["transactionId"]), ["bob"])
+
+        statements = []
+
+        @contextmanager
+        def traced(username, db):
+            with connect(db) as conn:
+                conn.set_trace_callback(statements.append)
+                yield conn
+
+        with mock.patch.object(open_banking, "connect_user", traced):
+            open_banking.load_transactions_page("bob", db=self.db)
+        with connect(self.db) as conn:
+            plan = conn.execute(f"EXPLAIN QUERY PLAN {statements[-1]}").fetchall()
+        self.assertIn("transactions_account_date", str(plan))
+
+    def test_resync_is_idempotent_without_transaction_ids(self):
+        coffee = _transaction("2022-01-02", "-3.00", creditorName="Cafe")
+        booked = [
+            _transaction("2022-01-01", "-9.99", transactionId="t1"),
+            _transaction("2022-01-03", "5.00", internalTransactionId="i1"),
+            coffee,
+            dict(coffee),
+        ]
+        for _ in range(3):
+            self._save(booked)
+        (page,) = self._pages(page_size=50)
+        self.assertEqual(len(page), 5)
+        self.assertEqual(page["transactionId"].nunique(), 5)
+        self.assertEqual((page["status"] == "pending").sum(), 1)
+
+    def test_zero_amount_bounds_split_inflows_and_outflows(self):
+        self._save(
+            [
+                _transaction("2022-01-01", "-2.00", transactionId="out"),
+                _transaction("2022-01-02", "3.00", transactionId="in"),
+            ]
+        )
+        (outflows,) = self._pages(page_size=50, status="booked", max_amount=0)
+        (inflows,) = self._pages(page_size=50, status="booked", min_amount=0)
+        self.assertEqual(list(outflows["transactionId"]), ["out"])
+        self.assertEqual(list(inflows["transactionId"]), ["in"])
+
+
+class TestSnapshots(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.mkdtemp()
+        self.db = path.join(tmp, "awesomebudget.db")
+        self.root = path.join(tmp, "snapshot")
+        create_tables(self.db)
+        register("bob", "password", self.db)
+        open_banking.save_requisition("bob", "req", "2030-01-01", self.db)
+        rows = {
+            "acc": [("t1", "2022-01-03", 1), ("t2", "2022-01-04", 2)]
+            + [("t3", "2022-02-01", 1), ("t4", "2022-02-02", 2)],
+            "acc2": [("t5", "2022-02-03", 2)],
+        }
+        for account, transactions in rows.items():
+            open_banking.save_account(account, "req", self.db)
+            ids, dates, _ = zip(*transactions)
+            df = pd.DataFrame(
+                {
+                    "transactionId": ids,
+                    "bookingDate": pd.to_datetime(dates),
+                    "transactionAmount_amount": -1.5,
+                    "transactionAmount_currency": "EUR",
+                    "status": "booked",
+                }
+            )
+            open_banking.save_transactions(account, df, self.db)
+        with connect(self.db) as conn:
+            conn.executemany(
+                "UPDATE transactions SET categories_id = ? WHERE transaction_id = ?",
+                [(c, i) for t in rows.values() for i, _, c in t],
+            )
+        self.assertEqual(snapshots.export_snapshot(self.root, "bob", db=self.db), 5)
+
+    def test_round_trip_and_column_pruning(self):
+        df = snapshots.load_snapshot(self.root)
+        self.assertEqual(sorted(df["transactionId"]), ["t1", "t2", "t3", "t4", "t5"])
+        self.assertEqual(set(df["transactionAmount_amount"]), {-1.5})
+        self.assertEqual(set(df["account"]), {"acc", "acc2"})
+        df = snapshots.load_snapshot(self.root, columns=["transactionId"], category=1)
+        self.assertEqual(list(df.columns), ["transactionId"])
+        self.assertEqual(sorted(df["transactionId"]), ["t1", "t3"])
+
+    def test_filters_prune_partitions_and_row_groups(self):
+        dataset = snapshots.open_snapshot(self.root)
+        expression = snapshots.snapshot_filter("acc", 2, start=date(2022, 2, 1))
+        fragments = list(dataset.get_fragments(filter=expression))
+        self.assertEqual(
+            [path.relpath(f.path, self.root) for f in fragments],
+            [path.join("account=acc", "month=2022-02", "part-0.parquet")],
+        )
+        # one row group per category, only category 2's is read
+        self.assertEqual(fragments[0].num_row_groups, 2)
+        (row_group,) = fragments[0].split_by_row_group(
+            filter=snapshots.ds.field("categories_id") == 2
+        )
+        self.assertEqual(row_group.to_table()["transactionId"].to_pylist(), ["t4"])
+
+    def test_failed_export_keeps_previous_snapshot(self):
+        with mock.patch.object(snapshots, "_to_batch", side_effect=OSError):
+            self.assertRaises(OSError, snapshots.export_snapshot, self.root, db=self.db)
+        renames = []
+
+        def flaky_rename(src, dst):
+            renames.append(src)
+            # fail moving the new account directory into place
+            if len(renames) == 2:
+                raise OSError("rename failed")
+            rename(src, dst)
+
+        with mock.patch.object(snapshots, "rename", flaky_rename):
+            self.assertRaises(OSError, snapshots.export_snapshot, self.root, db=self.db)
+        self.assertEqual(len(snapshots.load_snapshot(self.root)), 5)
+        self.assertEqual(sorted(listdir(self.root)), ["account=acc", "account=acc2"])
+
+
+class TestCompactTransactions(unittest.TestCase):
+    def setUp(self):
+        self.full = open_banking._normalise_transactions(
+            generate_transactions(500, seed=1)
+        ).reset_index(drop=True)
+
+    def test_round_trip_preserves_values(self):
+        compact = open_banking.compact_transactions(self.full)
+        self.assertEqual(compact["transactionAmount_amount"].dtype, "int64")
+        self.assertEqual(compact["bookingDate"].dtype, "Int32")
+        expanded = open_banking.expand_transactions(compact)
+        for column in ("bookingDate", "valueDate"):
+            # day numbers come back at second resolution
+            expanded[column] = expanded[column].astype(self.full[column].dtype)
+        pd.testing.assert_frame_equal(
+            expanded, self.full, check_dtype=False, check_categorical=False
+        )
+
+    def test_minor_units_follow_currency_exponent(self):
+        df = pd.DataFrame(
+            {
+                "bookingDate": pd.to_datetime(["2022-01-01", "2022-01-02"]),
+                "transactionAmount_amount": [1.23, 123.0],
+                "transactionAmount_currency": ["EUR", "JPY"],
+            }
+        )
+        compact = open_banking.compact_transactions(df)
+        self.assertEqual(list(compact["transactionAmount_amount"]), [123, 123])
+        expanded = open_banking.expand_transactions(compact)
+        self.assertEqual(list(expanded["transactionAmount_amount"]), [1.23, 123.0])
+
+    def test_monthly_totals_in_minor_units_match_float_totals(self):
+        df = pd.DataFrame(
+            {
+                "bookingDate": pd.to_datetime(["2022-01-01"] * 3 + ["2022-02-01"]),
+                "transactionAmount_amount": [0.1, 0.2, -0.3, 1.5],
+                "transactionAmount_currency": "EUR",
+            }
+        )
+        compact = monthly_totals(open_banking.compact_transactions(df))
+        full = monthly_totals(df)
+        self.assertEqual(list(compact), [0.0, 1.5])
+        self.assertEqual(list(compact), list(full))
+        self.assertEqual(compact.name, "transactionAmount_amount")
+        self.assertEqual(list(compact.index), list(full.index))
+
+
+class TestPredict(unittest.TestCase):
+    def setUp(self):
+        self.vectorizer = HashingVectorizer(n_features=2**10)
+        corpus = pd.Series(["tesco groceries", "uber trip", "rent payment"] * 5)
+        labels = pd.Series(
+            [categories["Groceries"], categories["Transport and Travel"], 1] * 5
+        )
+        self.model = fit_batch(corpus, labels, categories, self.vectorizer)
+
+    def test_missing_descriptions_are_other_in_both_representations(self):
+        X = pd.Series(["tesco groceries", pd.NA, "uber trip", pd.NA], dtype="string")
+        for series in (X, X.astype("category")):
+            y = predict(self.model, self.vectorizer, series)
+            self.assertEqual(list(y.index), list(X.index))
+            self.assertEqual(y[1], categories["Other"])
+            self.assertEqual(y[3], categories["Other"])
+        self.assertEqual(
+            list(predict(self.model, self.vectorizer, X)),
+            list(predict(self.model, self.vectorizer, X.astype("category"))),
+        )
+
+
+class TestStartup(unittest.TestCase):
+    def setUp(self):
+        self.db = path.join(tempfile.mkdtemp(), "awesomebudget.db")
+        self.addCleanup(startup._STATE.clear)
+        startup._STATE.clear()
+
+    def test_init_once_runs_once_per_process(self):
+        with mock.patch.object(utils, "create_tables", wraps=create_tables) as create:
+            state = startup.init_once(("id", "key"), self.db)
+            fernet = state["fernet"]
+            self.assertIs(startup.init_once(("id", "key"), self.db)["fernet"], fernet)
+        create.assert_called_once_with(self.db)
+
+    def test_get_token_is_cached_until_access_expires(self):
+        token = {"access_expires": datetime.now() + timedelta(hours=1)}
+        startup._STATE.update(fernet=None, token=token)
+        with mock.patch.object(open_banking, "load_token") as load:
+            self.assertIs(startup.get_token(("id", "key"), self.db), token)
+            load.assert_not_called()
+            token["access_expires"] = datetime.now() - timedelta(seconds=1)
+            load.return_value = fresh = {"access_expires": datetime.max}
+            self.assertIs(startup.get_token(("id", "key"), self.db), fresh)
+            self.assertIs(startup.get_token(("id", "key"), self.db), fresh)
+        load.assert_called_once()
+
+    def test_get_token_requests_a_new_token_when_none_is_saved(self):
+        create_tables(self.db)
+        fresh = {"access_expires": datetime.max}
+        with mock.patch.object(open_banking, "request_token", return_value=fresh):
+            with mock.patch.object(open_banking, "save_token") as save:
+                self.assertIs(startup.get_token(("id", "key"), self.db), fresh)
+        save.assert_called_once()
+
+    def test_lazy_module_defers_import(self):
+        code = (
+            "import sys; from src.startup import init_once, lazy_module;"
+            "import src.st_helpers; m = lazy_module('colorsys');"
+            "init_once(('id', 'key'), sys.argv[1]);"
+            "print('src.open_banking' in sys.modules, 'colorsys' in sys.modules);"
+            "m.rgb_to_hsv(0, 0, 0); print('colorsys' in sys.modules)"
+        )
+        out = subprocess.run(
+            [sys.executable, "-c", code, self.db],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        self.assertEqual(out.split(), ["False", "False", "True"])
+
+    def test_process_profile_total_excludes_idle_time(self):
+        profiler = startup.StartupProfiler(wall_clock=False)
+        with profiler.step("work"):
+            time.sleep(0.01)
+        time.sleep(0.05)
+        self.assertLess(profiler.total_ms, 40)
+        self.assertEqual(profiler.report()["total_ms"], round(profiler.total_ms, 3))
+
+
+class TestInstrumentation(unittest.TestCase):
+    def setUp(self):
+        self.addCleanup(instrumentation.reset)
+        self.addCleanup(setattr, instrumentation, "ENABLED", instrumentation.ENABLED)
+        instrumentation.reset()
+        instrumentation.enable()
+
+    def test_timer_records_latency_and_size(self):
+        with instrumentation.timer("http") as t:
+            t.size = 300
+        with instrumentation.timer("http"):
+            time.sleep(0.002)
+        metric = instrumentation.to_dict()["http"]
+        self.assertEqual(metric["count"], 2)
+        self.assertGreaterEqual(metric["total_ms"], 2)
+        self.assertEqual(metric["total_size"], 300)
+        self.assertEqual(metric["sizes"]["1024"], 1)
+
+    def test_disabled_timers_and_decorators_record_nothing(self):
+        calls = instrumentation.instrumented("f")(lambda x: x + 1)
+        instrumentation.disable()
+        with instrumentation.timer("http"):
+            pass
+        self.assertEqual(calls(1), 2)
+        self.assertEqual(instrumentation.to_dict(), {})
+        instrumentation.enable()
+        self.assertEqual(calls(1), 2)
+        self.assertEqual(instrumentation.to_dict()["f"]["count"], 1)
+
+    def test_connect_is_plain_when_disabled_and_timed_when_enabled(self):
+        timed = instrumentation.connect(":memory:")
+        timed.execute("CREATE TABLE t (x)")
+        timed.cursor().execute("SELECT x FROM t")
+        self.assertIn("sqlite.CREATE.t", instrumentation.to_dict())
+        self.assertIn("sqlite.SELECT.t", instrumentation.to_dict())
+        instrumentation.disable()
+        plain = instrumentation.connect(":memory:")
+        self.assertIs(type(plain), sqlite3.Connection)
+
+    def test_exports(self):
+        for ms in (0.5, 7, 20000):
+            instrumentation.observe("sync", ms, size=100)
+        self.assertEqual(json.loads(instrumentation.to_json())["sync"]["count"], 3)
+        lines = instrumentation.to_prometheus().splitlines()
+        latency = 'awesomebudget_latency_ms_bucket{name="sync",le="%s"} %d'
+        self.assertIn(latency % ("1", 1), lines)
+        self.assertIn(latency % ("10", 2), lines)
+        self.assertIn(latency % ("10000", 2), lines)
+        self.assertIn(latency % ("+Inf", 3), lines)
+        self.assertIn('awesomebudget_latency_ms_count{name="sync"} 3', lines)
+        self.assertIn('awesomebudget_latency_ms_sum{name="sync"} 20007.5', lines)
+        self.assertIn('awesomebudget_payload_size_count{name="sync"} 3', lines)
+        self.assertIn('awesomebudget_payload_size_sum{name="sync"} 300', lines)
+
+
+class TestSync(unittest.TestCase):
+    def setUp(self):
+        self.server = MockNordigenServer(("localhost", 0), MockConfig(100)).start()
+        self.addCleanup(self.server.shutdown)
+        self.addCleanup(
+            setattr, open_banking, "NORDIGEN_URL", open_banking.NORDIGEN_URL
+        )
+        open_banking.NORDIGEN_URL = self.server.url
+        self.db = path.join(tempfile.mkdtemp(), "awesomebudget.db")
+        create_tables(self.db)
+        register("bob", "password", self.db)
+        self.token = open_banking.request_token("id", "key")
+        open_banking.create_requisition(self.token, "MOCKBANK0_GB", "bob", self.db)
+        ((requisition_id,),) = open_banking.load_requisitions("bob", self.db)
+        (self.account,) = open_banking.get_accounts(self.token, requisition_id)["ids"]
+        open_banking.save_account(self.account, requisition_id, self.db)
+        self.addCleanup(CACHE.clear)
+
+    def test_sync_saves_balance_and_drops_cached_account_data(self):
+        synced = CacheKey("bob", self.account, "transactions")
+        other = CacheKey("bob", "other", "transactions")
+        CACHE.set(synced, 1)
+        CACHE.set(other, 1)
+        for _ in range(2):
+            open_banking.sync_account(self.token, self.account, self.db)
+        self.assertNotIn(synced, CACHE._entries)
+        self.assertIn(other, CACHE._entries)
+        with connect(self.db) as conn:
+            balances = conn.execute("SELECT balance FROM balance").fetchall()
+            (count,) = conn.execute("SELECT count(*) FROM transactions").fetchone()
+        self.assertEqual(balances, [(123456,), (123456,)])
+        self.assertEqual(count, 100)
+
+    def test_persistent_rate_limits_raise_after_retries(self):
+        self.server.config.error_rate = 1.0
+        self.server.stats.clear()
+        with self.assertRaises(open_banking.RateLimitError):
+            open_banking.get_balance(self.token, self.account)
+        self.assertEqual(self.server.stats["balances"], open_banking.MAX_RETRIES + 1)
+        self.server.stats.clear()
+        with mock.patch.object(open_banking, "MAX_RETRY_WAIT", 0.01):
+            with self.assertRaises(open_banking.RateLimitError):
+                open_banking.get_transasctions(self.token, self.account)
+        self.assertEqual(self.server.stats["transactions"], 1)
+
+    def test_api_errors_raise_invalid_endpoint_error(self):
+        with self.assertRaises(open_banking.InvalidEndpointError):
+            open_banking.get_accounts(self.token, "unknown")
+
+    def test_retry_after_accepts_seconds_and_http_dates(self):
+        res = requests.Response()
+        res.headers["Retry-After"] = "2.5"
+        self.assertEqual(open_banking._retry_after(res), 2.5)
+        later = datetime.now(timezone.utc) + timedelta(hours=1)
+        res.headers["Retry-After"] = format_datetime(later, usegmt=True)
+        self.assertGreater(open_banking._retry_after(res), 3500)
+        res.headers["Retry-After"] = "soon"
+        self.assertEqual(open_banking._retry_after(res), 1)
+
+
+class TestShards(unittest.TestCase):
+    def setUp(self):
+        self.db = path.join(tempfile.mkdtemp(), "awesomebudget.db")
+        create_tables(self.db, scope="catalogue")
+        self.addCleanup(setattr, utils, "SHARDED", utils.SHARDED)
+        self.addCleanup(ROUTER.close_all)
+        utils.SHARDED = True
+
+    def test_concurrent_first_access_sees_complete_shards(self):
+        for run in range(5):
+            username = f"user{run}"
+            register(username, "password", self.db)
+            with ThreadPoolExecutor(8) as pool:
+                list(
+                    pool.map(
+                        lambda i: open_banking.save_requisition(
+                            username, f"req{run}-{i}", "2030-01-01", self.db
+                        ),
+                        range(8),
+                    )
+                )
+            self.assertEqual(len(open_banking.load_requisitions(username, self.db)), 8)
+
+    def test_router_closes_idle_connections_past_max_open(self):
+        router = ShardRouter(max_open=2)
+        shards = []
+        for i in range(6):
+            register(f"user{i}", "password", self.db)
+            shards.append(router.shard_path(f"user{i}", self.db))
+        for shard in shards[:3]:
+            router.acquire(shard)
+        self.assertEqual(len(router), 3)
+        for shard in shards[:3]:
+            router.release(shard)
+        self.assertEqual(len(router), 2)
+        for shard in shards:
+            router.acquire(shard).execute("SELECT 1")
+            router.release(shard)
+        self.assertEqual(len(router), 2)
+        router.close_all()
+        self.assertEqual(len(router), 0)
+
+    def test_cached_connections_follow_instrumentation_toggle(self):
+        self.addCleanup(instrumentation.disable)
+        self.addCleanup(instrumentation.reset)
+        instrumentation.disable()
+        router = ShardRouter()
+        register("bob", "password", self.db)
+        shard = router.shard_path("bob", self.db)
+        router.acquire(shard).execute("SELECT 1")
+        router.release(shard)
+        instrumentation.enable()
+        router.acquire(shard).cursor().execute("SELECT 1")
+        router.release(shard)
+        self.assertIn("sqlite.SELECT", instrumentation.to_dict())
+        router.close_all()
+
+
+if __name__ == "__main__":
+    unittest.main()